@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import threading
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+logger = logging.getLogger(__name__)
+
+# Below this many vectors exact search is fast enough and always exact
+DEFAULT_THRESHOLD = 50000
+DEFAULT_M = 16
+DEFAULT_EF_CONSTRUCTION = 200
+DEFAULT_EF_SEARCH = 64
+SAVE_EVERY = 50000
+
+
+class HnswIndex:
+    """Optional HNSW index over integer-labelled vectors, persisted to ``path``.
+
+    Uses hnswlib when it is installed; otherwise ``wanted`` is always False
+    and callers keep searching exactly. ``m`` and ``ef_construction`` set the
+    graph quality when it is built, and ``ef_search`` trades recall for
+    latency at query time. Deleted labels are tombstoned, and adding a label
+    again replaces its vector. A JSON ``<path>.meta`` sidecar records the
+    parameters, the highest label added, the tombstones and an optional
+    ``state`` tag (such as the embedding model) the owner uses to recognise
+    a stale file.
+    """
+
+    def __init__(self, path, threshold=DEFAULT_THRESHOLD, m=DEFAULT_M, ef_construction=DEFAULT_EF_CONSTRUCTION,
+                 ef_search=DEFAULT_EF_SEARCH):
+        self.path = path
+        self.meta_path = path + ".meta"
+        self.threshold = threshold
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.lock = threading.RLock()
+        self.graph = None
+        self.dim = None
+        self.max_label = -1
+        self.deleted = set()
+        self.unsaved = 0
+        self.state = None
+
+    def wanted(self, size):
+        return hnswlib is not None and self.threshold is not None and size >= self.threshold
+
+    def __len__(self):
+        return 0 if self.graph is None else self.graph.get_current_count() - len(self.deleted)
+
+    def load(self, dim, state=None):
+        """Open the saved index if it was built for ``dim`` and ``state``; returns True on success."""
+        state = self.state if state is None else state
+        with self.lock:
+            if not (os.path.exists(self.path) and os.path.exists(self.meta_path)):
+                return False
+            try:
+                with open(self.meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                if meta["dim"] != dim or meta.get("state") != state or meta["m"] != self.m:
+                    logger.info(f"Ignoring stale ANN index {self.path}")
+                    return False
+                index = hnswlib.Index(space='cosine', dim=dim)
+                index.load_index(self.path, max_elements=meta["max_elements"])
+            except (OSError, ValueError, KeyError, RuntimeError) as e:
+                logger.warning(f"Could not load ANN index {self.path}: {e}")
+                return False
+            index.set_ef(self.ef_search)
+            self.graph, self.dim = index, dim
+            self.max_label = meta["max_label"]
+            self.deleted = set(meta.get("deleted", []))
+            self.unsaved = 0
+            logger.info(f"Loaded ANN index {self.path} with {len(self)} vectors")
+            return True
+
+    def reset(self):
+        with self.lock:
+            self.graph = None
+            self.max_label = -1
+            self.deleted = set()
+            self.unsaved = 0
+
+    def add(self, labels, vectors):
+        labels = np.asarray(labels, dtype=np.int64).reshape(-1)
+        if len(labels) == 0:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(labels), -1)
+        with self.lock:
+            if self.graph is None:
+                self.dim = vectors.shape[1]
+                self.graph = hnswlib.Index(space='cosine', dim=self.dim)
+                self.graph.init_index(max_elements=max(self.threshold, 2 * len(labels)), M=self.m,
+                                      ef_construction=self.ef_construction)
+                self.graph.set_ef(self.ef_search)
+            needed = self.graph.get_current_count() + len(labels)
+            if needed > self.graph.get_max_elements():
+                self.graph.resize_index(max(needed, 2 * self.graph.get_max_elements()))
+            self.graph.add_items(vectors, labels)
+            self.deleted.difference_update(labels.tolist())
+            self.max_label = max(self.max_label, int(labels.max()))
+            self.unsaved += len(labels)
+
+    def mark_deleted(self, labels):
+        with self.lock:
+            if self.graph is None:
+                return
+            for label in labels:
+                label = int(label)
+                if label in self.deleted:
+                    continue
+                try:
+                    self.graph.mark_deleted(label)
+                except RuntimeError:
+                    continue  # never added
+                self.deleted.add(label)
+                self.unsaved += 1
+
+    def set_ef(self, ef_search):
+        with self.lock:
+            self.ef_search = ef_search
+            if self.graph is not None:
+                self.graph.set_ef(ef_search)
+
+    def search(self, query_vector, k=5):
+        """Return ``[(label, cosine_similarity), ...]`` best first, or None if the caller should search exactly."""
+        with self.lock:
+            if self.graph is None:
+                return None
+            k = min(k, len(self))
+            if k <= 0:
+                return []
+            self.graph.set_ef(max(self.ef_search, k))
+            try:
+                labels, distances = self.graph.knn_query(np.asarray(query_vector, dtype=np.float32), k=k)
+            except RuntimeError as e:
+                # Too few reachable live nodes for k, e.g. after many deletions
+                logger.warning(f"ANN search failed, falling back to exact search: {e}")
+                return None
+            finally:
+                self.graph.set_ef(self.ef_search)
+            return [(int(label), 1.0 - float(distance)) for label, distance in zip(labels[0], distances[0])]
+
+    def save(self, state=None):
+        state = self.state if state is None else state
+        with self.lock:
+            if self.graph is None:
+                return
+            tmp_path = self.path + ".tmp"
+            self.graph.save_index(tmp_path)
+            os.replace(tmp_path, self.path)
+            meta = {"dim": self.dim, "m": self.m, "max_elements": self.graph.get_max_elements(),
+                    "max_label": self.max_label, "deleted": sorted(self.deleted), "state": state}
+            with open(self.meta_path + ".tmp", 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(self.meta_path + ".tmp", self.meta_path)
+            self.unsaved = 0
+            logger.info(f"Saved ANN index {self.path} with {len(self)} vectors")
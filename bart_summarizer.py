@@ -0,0 +1,157 @@
+import gc
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+BART_MODEL_NAME = 'facebook/bart-large-cnn'
+
+
+class LazyBartSummarizer:
+    """BART summariser that loads on first use and unloads after sitting idle.
+
+    Loading runs on a background thread; ``preload`` starts it without
+    waiting, and ``acquire`` waits for it. The model stays resident while any
+    caller holds it and is released ``idle_seconds`` after the last use.
+    """
+
+    def __init__(self, model_name=BART_MODEL_NAME, idle_seconds=300):
+        self.model_name = model_name
+        self.idle_seconds = idle_seconds
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="BartLoader")
+        self._loading = None
+        self._users = 0
+        self._idle_timer = None
+        self.last_used = 0.0
+
+    @property
+    def loaded(self):
+        return self._loading is not None and self._loading.done() and self._loading.exception() is None
+
+    def preload(self):
+        """Start loading in the background if the model is not already loaded or loading."""
+        with self.lock:
+            if self._loading is None:
+                self._loading = self.executor.submit(self._load)
+            return self._loading
+
+    def _load(self):
+        from transformers import BartForConditionalGeneration, BartTokenizer
+        started = time.monotonic()
+        model = BartForConditionalGeneration.from_pretrained(self.model_name)
+        tokenizer = BartTokenizer.from_pretrained(self.model_name)
+        logger.info(f"Loaded {self.model_name} in {time.monotonic() - started:.1f}s")
+        return model, tokenizer
+
+    @contextmanager
+    def acquire(self):
+        """Yield ``(model, tokenizer)``, loading them first if necessary."""
+        loading = self.preload()
+        try:
+            model, tokenizer = loading.result()
+        except Exception:
+            with self.lock:
+                if self._loading is loading:
+                    self._loading = None
+            raise
+        with self.lock:
+            self._users += 1
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+                self._idle_timer = None
+        try:
+            yield model, tokenizer
+        finally:
+            with self.lock:
+                self._users -= 1
+                self.last_used = time.monotonic()
+                if self._users == 0 and self.idle_seconds is not None:
+                    self._idle_timer = threading.Timer(self.idle_seconds, self._unload_if_idle)
+                    self._idle_timer.daemon = True
+                    self._idle_timer.start()
+
+    def _unload_if_idle(self):
+        with self.lock:
+            if self._users or time.monotonic() - self.last_used < self.idle_seconds:
+                return
+            self._unload_locked()
+
+    def _unload_locked(self):
+        if self._loading is not None:
+            self._loading = None
+            gc.collect()
+            logger.info(f"Unloaded idle {self.model_name}")
+
+    def unload(self):
+        with self.lock:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+                self._idle_timer = None
+            if not self._users:
+                self._unload_locked()
+
+    def summarize(self, text, max_length=150, num_beams=4, input_max_length=1024):
+        with self.acquire() as (model, tokenizer):
+            inputs = tokenizer([text], max_length=input_max_length, return_tensors='pt', truncation=True)
+            summary_ids = model.generate(inputs['input_ids'], num_beams=num_beams, max_length=max_length,
+                                         early_stopping=True)
+            return tokenizer.decode(summary_ids[0], skip_special_tokens=True)
+
+    def summarize_long(self, texts, max_length=150, chunk_tokens=900, batch_size=4, num_beams=4, max_rounds=3):
+        """Map-reduce summary of ``texts`` that may be far longer than BART's 1024-token window.
+
+        The texts are packed in order into chunks of at most ``chunk_tokens``
+        tokens, each chunk is summarised (``batch_size`` chunks per padded
+        ``generate`` call), and the chunk summaries are packed and summarised
+        again until they fit in a single chunk. After ``max_rounds`` the
+        remainder is truncated into one final pass, which bounds the run time.
+        """
+        texts = [text for text in texts if text and text.strip()]
+        if not texts:
+            return ""
+        with self.acquire() as (model, tokenizer):
+            chunks = self._pack(tokenizer, texts, chunk_tokens)
+            rounds = 0
+            while len(chunks) > 1 and rounds < max_rounds:
+                summaries = self._generate(model, tokenizer, chunks, max_length, batch_size, num_beams)
+                chunks = self._pack(tokenizer, summaries, chunk_tokens)
+                rounds += 1
+            return self._generate(model, tokenizer, [" ".join(chunks)], max_length, batch_size, num_beams)[0]
+
+    @staticmethod
+    def _pack(tokenizer, texts, chunk_tokens):
+        """Greedily group texts into chunks of at most ``chunk_tokens`` tokens, splitting oversized texts."""
+        lengths = [len(ids) for ids in tokenizer(texts, add_special_tokens=False)['input_ids']]
+        chunks, current, current_tokens = [], [], 0
+        for text, length in zip(texts, lengths):
+            if length > chunk_tokens:
+                ids = tokenizer(text, add_special_tokens=False)['input_ids']
+                pieces = [tokenizer.decode(ids[i:i + chunk_tokens], skip_special_tokens=True)
+                          for i in range(0, len(ids), chunk_tokens)]
+            else:
+                pieces = [text]
+            for piece in pieces:
+                piece_tokens = min(length, chunk_tokens)
+                if current and current_tokens + piece_tokens > chunk_tokens:
+                    chunks.append(" ".join(current))
+                    current, current_tokens = [], 0
+                current.append(piece)
+                current_tokens += piece_tokens
+        if current:
+            chunks.append(" ".join(current))
+        return chunks
+
+    @staticmethod
+    def _generate(model, tokenizer, chunks, max_length, batch_size, num_beams):
+        summaries = []
+        for start in range(0, len(chunks), batch_size):
+            batch = chunks[start:start + batch_size]
+            inputs = tokenizer(batch, max_length=1024, return_tensors='pt', truncation=True, padding=True)
+            summary_ids = model.generate(inputs['input_ids'], attention_mask=inputs['attention_mask'],
+                                         num_beams=num_beams, max_length=max_length, early_stopping=True)
+            summaries.extend(tokenizer.batch_decode(summary_ids, skip_special_tokens=True))
+        return summaries
@@ -0,0 +1,94 @@
+import sqlite3
+import threading
+import logging
+import weakref
+
+logger = logging.getLogger(__name__)
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+class _ThreadConnections:
+    """A thread's connections by path, held in its thread-local storage."""
+
+    def __init__(self):
+        self.conns = {}
+
+
+def _close_all(conns):
+    for db_path, conn in list(conns.items()):
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Error closing connection to {db_path}: {e}")
+    conns.clear()
+
+
+class ConnectionManager:
+    """One SQLite connection per (database path, thread), tuned for WAL.
+
+    Each thread gets its own connection, so QThread workers can read while
+    another thread writes. ``schema`` callbacks run once per path on the
+    first connection, and ``close`` closes the connections of every thread.
+    A thread's connections are closed when it exits and its thread-local
+    storage is released; workers can also call ``release_thread`` when done.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.threads = weakref.WeakSet()
+        self.prepared = set()
+
+    def get(self, db_path, schema=None):
+        holder = getattr(self.local, 'holder', None)
+        if holder is None:
+            holder = self.local.holder = _ThreadConnections()
+            # Refers to the dict, not the holder, so the holder can be collected
+            weakref.finalize(holder, _close_all, holder.conns)
+            with self.lock:
+                self.threads.add(holder)
+        conn = holder.conns.get(db_path)
+        if conn is None:
+            logger.info(f"Creating new connection to {db_path}")
+            # Connections never cross threads; check_same_thread is relaxed
+            # only so close() can shut down other threads' connections.
+            conn = sqlite3.connect(db_path, check_same_thread=False)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            holder.conns[db_path] = conn
+            with self.lock:
+                if schema is not None and db_path not in self.prepared:
+                    schema(conn)
+                    conn.commit()
+                    self.prepared.add(db_path)
+        return conn
+
+    def release_thread(self):
+        """Close the calling thread's connections."""
+        holder = getattr(self.local, 'holder', None)
+        if holder is not None:
+            _close_all(holder.conns)
+
+    def close(self, db_path):
+        with self.lock:
+            for holder in list(self.threads):
+                conn = holder.conns.pop(db_path, None)
+                if conn is None:
+                    continue
+                try:
+                    conn.close()
+                except sqlite3.Error as e:
+                    logger.warning(f"Error closing connection to {db_path}: {e}")
+            self.prepared.discard(db_path)
+            logger.info(f"Closed database connections to {db_path}")
+
+
+connections = ConnectionManager()
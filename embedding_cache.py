@@ -0,0 +1,122 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import logging
+from collections import OrderedDict
+import numpy as np
+from db_connections import PRAGMAS
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """Persistent content-addressed cache of sentence embeddings.
+
+    Entries are keyed by ``sha256(model_name + text)`` and stored as float32
+    blobs in a small SQLite file. A bounded in-memory LRU sits in front of it,
+    and the file itself is trimmed to ``max_entries`` by least recent use.
+    Hits, from memory or the file, only read; their ``last_used`` times are
+    written in batches, together with the next insert or once ``TOUCH_BATCH``
+    collect.
+    """
+
+    TOUCH_BATCH = 1024
+
+    def __init__(self, db_path='embedding_cache.db', max_entries=200000, memory_entries=4096):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.touched = {}
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for pragma in PRAGMAS:
+            self.conn.execute(pragma)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                key TEXT PRIMARY KEY,
+                embedding BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache(last_used)')
+        self.conn.commit()
+        self.count = self.conn.execute('SELECT COUNT(*) FROM embedding_cache').fetchone()[0]
+
+    @staticmethod
+    def make_key(model_name, text):
+        return hashlib.sha256(f"{model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    def _remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def get_many(self, keys):
+        """Return ``{key: vector}`` for every key found in the cache."""
+        found = {}
+        with self.lock:
+            now = time.time()
+            missing = []
+            for key in keys:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    found[key] = self.memory[key]
+                    # Memory hits count as uses too, or the hottest keys would be trimmed first
+                    self.touched[key] = now
+                else:
+                    missing.append(key)
+            if missing:
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start:start + 500]
+                    placeholders = ','.join('?' * len(chunk))
+                    rows = self.conn.execute(
+                        f'SELECT key, embedding FROM embedding_cache WHERE key IN ({placeholders})', chunk).fetchall()
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32)
+                        found[key] = vector
+                        self._remember(key, vector)
+                    for key, _ in rows:
+                        self.touched[key] = now
+                if len(self.touched) >= self.TOUCH_BATCH:
+                    self._write_touched()
+                    self.conn.commit()
+        return found
+
+    def _write_touched(self):
+        if self.touched:
+            self.conn.executemany('UPDATE embedding_cache SET last_used = ? WHERE key = ?',
+                                  [(used, key) for key, used in self.touched.items()])
+            self.touched = {}
+
+    def put_many(self, items):
+        """Store ``[(key, vector), ...]`` and evict the least recently used overflow."""
+        if not items:
+            return
+        now = time.time()
+        with self.lock:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO embedding_cache (key, embedding, last_used) VALUES (?, ?, ?)',
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items])
+            self.count += self.conn.total_changes - before
+            for key, vector in items:
+                self._remember(key, np.asarray(vector, dtype=np.float32))
+            self._write_touched()
+            if self.count > self.max_entries:
+                # Trim to 90% so eviction does not run on every insert
+                excess = self.count - int(self.max_entries * 0.9)
+                self.conn.execute(
+                    'DELETE FROM embedding_cache WHERE key IN '
+                    '(SELECT key FROM embedding_cache ORDER BY last_used LIMIT ?)', (excess,))
+                self.count -= excess
+                logger.info(f"Evicted {excess} entries from embedding cache")
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self._write_touched()
+            self.conn.commit()
+            self.conn.close()
@@ -0,0 +1,94 @@
+import threading
+import logging
+from collections import Counter
+import numpy as np
+from embedding_cache import EmbeddingCache
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+CACHE_PATH = 'embedding_cache.db'
+
+_models = {}
+# Number of vector stores currently using each model
+_model_users = Counter()
+_cache = None
+_lock = threading.Lock()
+
+
+def get_model(model_name=None):
+    """Return the process-wide SentenceTransformer for ``model_name``, loading it on first use."""
+    model_name = model_name or MODEL_NAME
+    model = _models.get(model_name)
+    if model is None:
+        with _lock:
+            model = _models.get(model_name)
+            if model is None:
+                from sentence_transformers import SentenceTransformer
+                logger.info(f"Loading embedding model {model_name}")
+                model = _models[model_name] = SentenceTransformer(model_name)
+    return model
+
+
+def release_model(model_name):
+    with _lock:
+        _models.pop(model_name, None)
+
+
+def track_model(old_model, new_model):
+    """Record that a store switched from ``old_model`` to ``new_model`` (either may be None).
+
+    ``old_model`` is unloaded once no store uses it any more, so a process
+    that follows a reindex does not keep the previous model resident.
+    """
+    with _lock:
+        if new_model is not None:
+            _model_users[new_model] += 1
+        if old_model is not None:
+            _model_users[old_model] -= 1
+            if _model_users[old_model] <= 0:
+                del _model_users[old_model]
+                if _models.pop(old_model, None) is not None:
+                    logger.info(f"Unloaded embedding model {old_model}")
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = EmbeddingCache(CACHE_PATH)
+    return _cache
+
+
+def encode(texts, use_cache=True, model_name=None):
+    """Encode a list of texts with ``model_name`` (default MODEL_NAME) into a float32 array.
+
+    Texts already in the embedding cache are not re-encoded; the rest are
+    encoded in a single batch and added to it.
+    """
+    model_name = model_name or MODEL_NAME
+    if not use_cache:
+        return np.asarray(get_model(model_name).encode(texts), dtype=np.float32)
+
+    cache = get_cache()
+    keys = [cache.make_key(model_name, text) for text in texts]
+    found = cache.get_many(set(keys))
+
+    pending = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in pending:
+            pending[key] = text
+    if pending:
+        vectors = np.asarray(get_model(model_name).encode(list(pending.values())), dtype=np.float32)
+        new_items = list(zip(pending.keys(), vectors))
+        cache.put_many(new_items)
+        found.update(new_items)
+
+    if not keys:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.stack([found[key] for key in keys])
+
+
+def encode_one(text, model_name=None):
+    return encode([text], model_name=model_name)[0]
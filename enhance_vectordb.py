@@ -1,67 +1,218 @@
 import sqlite3
-import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
-from transformers import BartForConditionalGeneration, BartTokenizer
-from summa import summarizer
-from sklearn.cluster import KMeans
-import threading
+import re
+import embedding_service
+import ann_index
+import vector_codec
+from vector_search import EmbeddingMatrix
+from db_connections import connections
+import summary_pool
+from memory_rollup import MemoryRollup
 import logging
 import os
+import threading
+import datetime
+from concurrent.futures import Future
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-class EnhancedVectorDatabase:
-    _local = threading.local()
+# Timestamps are stored by SQLite's CURRENT_TIMESTAMP as UTC text
+DB_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+MIN_TIME = "0000-01-01 00:00:00"
+MAX_TIME = "9999-12-31 23:59:59"
 
 
+# Text column of each table covered by the search index and embedding matrices
+TEXT_COLUMNS = {'messages': 'text', 'summaries': 'summary', 'conversation_summaries': 'summary'}
+SEARCH_SOURCES = tuple(TEXT_COLUMNS)
+# Every table holding an embedding of its text column, as re-encoded on a model swap
+EMBEDDED_COLUMNS = dict(TEXT_COLUMNS, summary_rollups='summary')
 
-    def __init__(self, db_path='enhanced_chatbot.db'):
-        self.db_path = os.path.abspath(db_path)
-        logger.info(f"Database path: {self.db_path}")
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.bart_model = BartForConditionalGeneration.from_pretrained('facebook/bart-large-cnn')
-        self.bart_tokenizer = BartTokenizer.from_pretrained('facebook/bart-large-cnn')
-
-    def semantic_search(self, query, k=5):
-        query_embedding = self.model.encode([query])[0]
 
-        # Fetch all stored embeddings and their corresponding content
-        cursor = self.get_connection().cursor()
-        cursor.execute('SELECT embedding, text FROM messages')
-        stored_embeddings = []
-        stored_content = []
+def to_db_time(value):
+    """Convert a datetime, date or string to the UTC text format used in the tables."""
+    if value is None or isinstance(value, str):
+        return value
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time.min)
+    return value.astimezone(datetime.timezone.utc).strftime(DB_TIME_FORMAT)
 
-        for row in cursor.fetchall():
-            stored_embeddings.append(np.frombuffer(row[0], dtype=np.float32))
-            stored_content.append(row[1])
 
-        stored_embeddings = np.array(stored_embeddings)
-
-        # Calculate cosine similarities
-        similarities = cosine_similarity([query_embedding], stored_embeddings)[0]
-
-        # Get top k results
-        top_k_indices = np.argsort(similarities)[-k:][::-1]
-
-        results = [
-            {"similarity": float(similarities[i]), "content": stored_content[i]}
-            for i in top_k_indices
+class EnhancedVectorDatabase:
+    def __init__(self, db_path='enhanced_chatbot.db', summarizer_idle_seconds=300, summary_processes=True,
+                 ann_threshold=ann_index.DEFAULT_THRESHOLD, ann_ef_search=ann_index.DEFAULT_EF_SEARCH,
+                 storage=vector_codec.DEFAULT_FORMAT):
+        self.db_path = os.path.abspath(db_path)
+        logger.info(f"Database path: {self.db_path}")
+        # Format of new embedding BLOBs and of the in-memory matrices
+        self.storage = vector_codec.check_format(storage)
+        # Each table's ANN index lives next to the database, e.g. enhanced_chatbot.db.messages.hnsw
+        self.matrices = {
+            table: EmbeddingMatrix(ann_index.HnswIndex(f"{self.db_path}.{table}.hnsw", threshold=ann_threshold,
+                                                       ef_search=ann_ef_search),
+                                   storage=self.storage)
+            for table in TEXT_COLUMNS
+        }
+        self.message_matrix = self.matrices['messages']
+        # Model the stored embeddings were made with, read from embedding_meta
+        self.embedding_model = None
+        self.fts_available = True
+        self.summary_lock = threading.Lock()
+        self.rollups = MemoryRollup(self)
+        self.pending_watermark = None
+        # Summaries run in a worker process that loads BART on first use
+        self.summary_pool = summary_pool.SummaryPool(idle_seconds=summarizer_idle_seconds,
+                                                     processes=summary_processes)
+
+    def current_embedding_model(self):
+        """Return the active embedding model, dropping cached matrices if another process swapped it."""
+        cursor = self.get_connection().cursor()
+        cursor.execute("SELECT value FROM embedding_meta WHERE key = 'model'")
+        model = cursor.fetchone()[0]
+        if model != self.embedding_model:
+            if self.embedding_model is not None:
+                logger.info(f"Embedding model changed from {self.embedding_model} to {model}")
+            embedding_service.track_model(self.embedding_model, model)
+            for matrix in self.matrices.values():
+                with matrix.lock:
+                    matrix.reset()
+                    matrix.index.reset()
+                    matrix.index.state = model
+            self.embedding_model = model
+        return model
+
+    def embed(self, texts):
+        """Encode ``texts`` for storage; returns ``(model, vectors)`` so rows can be tagged with the model."""
+        model = self.current_embedding_model()
+        return model, embedding_service.encode(texts, model_name=model)
+
+    def insert_embedded(self, texts, insert):
+        """Encode ``texts`` and store them with ``insert(conn, model, blobs)`` in one write transaction.
+
+        The active model is read again once the transaction holds the write
+        lock. If reindex.py switched it after the texts were encoded, they are
+        encoded again, so no row is stored with the replaced model.
+        """
+        model, embeddings = self.embed(texts)
+        conn = self.get_connection()
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                active = conn.execute("SELECT value FROM embedding_meta WHERE key = 'model'").fetchone()[0]
+                if active == model:
+                    insert(conn, model, [vector_codec.encode(embedding, self.storage) for embedding in embeddings])
+                    conn.commit()
+                    return
+            except Exception:
+                conn.rollback()
+                raise
+            conn.rollback()
+            model, embeddings = self.embed(texts)
+
+    def embed_query(self, text):
+        return embedding_service.encode_one(text, model_name=self.current_embedding_model())
+
+    def semantic_search(self, query, k=5, start=None, end=None):
+        """Top ``k`` messages by similarity, optionally only those sent between ``start`` and ``end``."""
+        query_embedding = self.embed_query(query)
+        window_ids = None
+        if start is not None or end is not None:
+            cursor = self.get_connection().cursor()
+            cursor.execute('SELECT id FROM messages WHERE timestamp >= ? AND timestamp <= ?',
+                           (to_db_time(start) or MIN_TIME, to_db_time(end) or MAX_TIME))
+            window_ids = sorted(row[0] for row in cursor.fetchall())
+            if not window_ids:
+                return []
+        return [
+            {"similarity": similarity, "content": text}
+            for _, text, similarity in self._search_matrix('messages', query_embedding, k, ids=window_ids)
         ]
 
-        return results
-
+    def _search_matrix(self, table, query_embedding, k, ids=None):
+        """Top ``k`` rows of ``table`` by similarity as ``[(id, text, similarity), ...]``, best first."""
+        self._sync_matrix(table)
+        matrix = self.matrices[table]
+        hits = matrix.search(query_embedding, k, ids=ids)
+        texts = self._fetch_texts(table, [row_id for row_id, _ in hits])
+        if len(texts) < len(hits):
+            # Rows were deleted behind our back; rebuild and try again
+            matrix.forget([row_id for row_id, _ in hits if row_id not in texts])
+            self.invalidate_matrix(table)
+            self._sync_matrix(table)
+            hits = matrix.search(query_embedding, k, ids=ids)
+            texts = self._fetch_texts(table, [row_id for row_id, _ in hits])
+        return [(row_id, texts[row_id], similarity) for row_id, similarity in hits if row_id in texts]
+
+    def _fetch_texts(self, table, ids):
+        if not ids:
+            return {}
+        placeholders = ','.join('?' * len(ids))
+        cursor = self.get_connection().cursor()
+        cursor.execute(f'SELECT id, {TEXT_COLUMNS[table]} FROM {table} WHERE id IN ({placeholders})', ids)
+        return dict(cursor.fetchall())
+
+    def _sync_message_matrix(self):
+        self._sync_matrix('messages')
+
+    def _sync_matrix(self, table):
+        """Load any rows of ``table`` newer than its in-memory matrix."""
+        model = self.current_embedding_model()
+        matrix = self.matrices[table]
+        with matrix.lock:
+            cursor = self.get_connection().cursor()
+            cursor.execute(f'SELECT MAX(id) FROM {table}')
+            max_id = cursor.fetchone()[0] or 0
+            if max_id <= matrix.max_id:
+                return
+            self._reencode_stale(table, model, matrix.max_id)
+            cursor.execute(f'SELECT id, embedding FROM {table} WHERE id > ? ORDER BY id', (matrix.max_id,))
+            while True:
+                rows = cursor.fetchmany(10000)
+                if not rows:
+                    break
+                matrix.append(
+                    [row[0] for row in rows],
+                    vector_codec.decode_many([row[1] for row in rows]))
+
+    def _reencode_stale(self, table, model, after_id):
+        """Re-encode rows of ``table`` after ``after_id`` that were not embedded with ``model``.
+
+        Such rows come from a writer that inserted with the previous model
+        after a reindex; their vectors would not fit in the matrix.
+        """
+        column = TEXT_COLUMNS[table]
+        conn = self.get_connection()
+        # NULL marks rows embedded with the default model before models were recorded
+        stale = conn.execute(f'SELECT id, {column} FROM {table} WHERE id > ? AND COALESCE(embedding_model, ?) != ?',
+                             (after_id, embedding_service.MODEL_NAME, model)).fetchall()
+        if not stale:
+            return
+        vectors = embedding_service.encode([text for _, text in stale], model_name=model)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute("SELECT value FROM embedding_meta WHERE key = 'model'").fetchone()[0] != model:
+                raise RuntimeError(f"Embedding model of {self.db_path} changed while re-encoding {table}")
+            conn.executemany(f'UPDATE {table} SET embedding = ?, embedding_model = ? WHERE id = ?',
+                             [(vector_codec.encode(vector, self.storage), model, row_id)
+                              for (row_id, _), vector in zip(stale, vectors)])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.warning(f"Re-encoded {len(stale)} {table} rows stored with a replaced embedding model")
+
+    def invalidate_matrix(self, table):
+        """Drop the in-memory matrix of ``table`` so the next search reloads it."""
+        self.matrices[table].reset()
+
+    def invalidate_message_matrix(self):
+        self.invalidate_matrix('messages')
 
     def get_connection(self):
-        if not hasattr(self._local, 'conn'):
-            self._local.conn = sqlite3.connect(self.db_path)
-            self.create_tables()
-        return self._local.conn
+        return connections.get(self.db_path, self.create_tables)
 
-    def create_tables(self):
-        cursor = self.get_connection().cursor()
+    def create_tables(self, conn):
+        cursor = conn.cursor()
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS messages (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -88,46 +239,301 @@ class EnhancedVectorDatabase:
                 end_time DATETIME NOT NULL
             )
         ''')
-        self.get_connection().commit()
-    def add_message(self, text):
-        embedding = self.model.encode([text])[0]
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS summary_rollups (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                level TEXT NOT NULL,
+                period_start DATETIME NOT NULL,
+                period_end DATETIME NOT NULL,
+                summary TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                source_count INTEGER NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (level, period_start)
+            )
+        ''')
+        cursor.execute('PRAGMA table_info(conversation_summaries)')
+        columns = {row[1] for row in cursor.fetchall()}
+        for column in ('first_message_id', 'last_message_id'):
+            if column not in columns:
+                cursor.execute(f'ALTER TABLE conversation_summaries ADD COLUMN {column} INTEGER')
+        for table in EMBEDDED_COLUMNS:
+            cursor.execute(f'PRAGMA table_info({table})')
+            if 'embedding_model' not in {row[1] for row in cursor.fetchall()}:
+                # NULL marks rows embedded before models were recorded
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN embedding_model TEXT')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS embedding_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO embedding_meta (key, value) VALUES ('model', ?)",
+                       (embedding_service.MODEL_NAME,))
+        # Re-encodings made by reindex.py, swapped in once every row has one
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS embedding_staging (
+                source TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                embedding BLOB NOT NULL,
+                PRIMARY KEY (source, id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversation_summaries_last_message_id '
+                       'ON conversation_summaries(last_message_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_summaries_end_time ON summaries(end_time)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversation_summaries_end_time '
+                       'ON conversation_summaries(end_time)')
+        self.create_search_index(conn)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS imported_logs (
+                path TEXT PRIMARY KEY,
+                imported_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.commit()
+    def create_search_index(self, conn):
+        """Create the FTS5 index over messages and both summary tables, kept in sync by triggers.
+
+        Rows are keyed ``id * 3 + source code`` so triggers can find them by rowid.
+        """
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'search_index'")
+        exists = cursor.fetchone() is not None
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search_index "
+                           "USING fts5(content, tokenize='porter unicode61')")
+        except sqlite3.OperationalError as e:
+            logger.warning(f"FTS5 unavailable, lexical search disabled: {e}")
+            self.fts_available = False
+            return
+        for table, column in TEXT_COLUMNS.items():
+            code = SEARCH_SOURCES.index(table)
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_search_insert AFTER INSERT ON {table} BEGIN
+                    INSERT INTO search_index (rowid, content) VALUES (new.id * 3 + {code}, new.{column});
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_search_delete AFTER DELETE ON {table} BEGIN
+                    DELETE FROM search_index WHERE rowid = old.id * 3 + {code};
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_search_update AFTER UPDATE OF {column} ON {table} BEGIN
+                    UPDATE search_index SET content = new.{column} WHERE rowid = old.id * 3 + {code};
+                END
+            ''')
+            if not exists:
+                logger.info(f"Indexing existing {table} rows for full-text search")
+                cursor.execute(f'INSERT INTO search_index (rowid, content) SELECT id * 3 + {code}, {column} FROM {table}')
+
+    def lexical_search(self, query, k=50, sources=SEARCH_SOURCES):
+        """BM25-ranked full-text matches as ``[(source, id, bm25), ...]``, best first.
+
+        Any of the query's words may match; lower bm25 values are better.
+        """
+        terms = re.findall(r'\w+', query)
+        if not terms or not self.fts_available:
+            return []
+        match = " OR ".join(f'"{term}"' for term in terms)
+        codes = ','.join(str(SEARCH_SOURCES.index(source)) for source in sources)
         cursor = self.get_connection().cursor()
-        cursor.execute('INSERT INTO messages (text, embedding) VALUES (?, ?)',
-                       (text, embedding.tobytes()))
-        self.get_connection().commit()
+        cursor.execute(f'SELECT rowid, bm25(search_index) FROM search_index '
+                       f'WHERE search_index MATCH ? AND rowid % 3 IN ({codes}) ORDER BY rank LIMIT ?',
+                       (match, k))
+        return [(SEARCH_SOURCES[rowid % 3], rowid // 3, score) for rowid, score in cursor.fetchall()]
+
+    def hybrid_search(self, query, k=5, sources=SEARCH_SOURCES, candidates=50, rrf_k=60):
+        """Fuse BM25 and embedding similarity with reciprocal rank fusion.
+
+        Full-text matches are re-scored by vector similarity, the dense top
+        ``candidates`` of each source are added, and every candidate is scored
+        ``1 / (rrf_k + lexical rank) + 1 / (rrf_k + dense rank)``. Returns dicts
+        with source, id, content, score, similarity and bm25 (None where a
+        candidate was not found by that stage).
+        """
+        query_embedding = self.embed_query(query)
+        lexical = self.lexical_search(query, candidates, sources)
+        bm25 = {(source, row_id): score for source, row_id, score in lexical}
+
+        similarity = {}
+        for source in sources:
+            self._sync_matrix(source)
+            matrix = self.matrices[source]
+            for row_id, score in matrix.search(query_embedding, candidates):
+                similarity[(source, row_id)] = score
+            lexical_ids = sorted(row_id for s, row_id in bm25 if s == source)
+            if lexical_ids:
+                for row_id, score in matrix.search(query_embedding, len(lexical_ids), ids=lexical_ids):
+                    similarity[(source, row_id)] = score
+
+        fused = {}
+        for rank, key in enumerate(sorted(bm25, key=bm25.get)):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+        for rank, key in enumerate(sorted(similarity, key=similarity.get, reverse=True)):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+        best = sorted(fused, key=fused.get, reverse=True)[:k]
+
+        contents = {}
+        for source in sources:
+            ids = [row_id for s, row_id in best if s == source]
+            if ids:
+                placeholders = ','.join('?' * len(ids))
+                cursor = self.get_connection().cursor()
+                cursor.execute(f'SELECT id, {TEXT_COLUMNS[source]} FROM {source} WHERE id IN ({placeholders})', ids)
+                contents.update({(source, row_id): text for row_id, text in cursor.fetchall()})
+
+        return [
+            {"source": key[0], "id": key[1], "content": contents[key], "score": fused[key],
+             "similarity": similarity.get(key), "bm25": bm25.get(key)}
+            for key in best if key in contents
+        ]
 
-    def create_conversation_summary(self, max_messages=100):
+    def add_message(self, text):
+        self.add_messages([text])
+
+    def add_messages(self, texts, timestamps=None):
+        """Encode and insert several messages with one batch encode and one commit.
+
+        ``timestamps`` optionally gives a UTC 'YYYY-MM-DD HH:MM:SS' string per
+        message; otherwise the insert time is used.
+        """
+        texts = list(texts)
+        if not texts:
+            return
+
+        def insert(conn, model, blobs):
+            if timestamps is None:
+                conn.executemany('INSERT INTO messages (text, embedding, embedding_model) VALUES (?, ?, ?)',
+                                 [(text, blob, model) for text, blob in zip(texts, blobs)])
+            else:
+                conn.executemany('INSERT INTO messages (text, embedding, embedding_model, timestamp) '
+                                 'VALUES (?, ?, ?, ?)',
+                                 [(text, blob, model, timestamp)
+                                  for text, blob, timestamp in zip(texts, blobs, timestamps)])
+
+        self.insert_embedded(texts, insert)
+        if len(self.message_matrix):
+            self._sync_message_matrix()
+
+    def create_conversation_summary(self, max_messages=100, write_queue=None):
+        return self.submit_conversation_summary(max_messages, write_queue).result()
+
+    def submit_conversation_summary(self, max_messages=100, write_queue=None):
+        """Summarise messages added since the last conversation summary in the summary worker process.
+
+        At most ``max_messages`` new messages are taken, oldest first, and the
+        previous summary is folded in ahead of them, so the cost follows new
+        traffic rather than the window size. Returns a Future that resolves to
+        the summary once it has been stored (or queued on ``write_queue``), or
+        to None when there is nothing new to summarise.
+        """
+        result = Future()
+        with self.summary_lock:
+            watermark, previous_summary = self.get_summary_watermark()
+            cursor = self.get_connection().cursor()
+            if watermark is None:
+                # No summary has recorded a watermark yet; start from the latest window
+                cursor.execute('SELECT id, text, timestamp FROM messages ORDER BY id DESC LIMIT ?', (max_messages,))
+                messages = cursor.fetchall()[::-1]
+            else:
+                cursor.execute('SELECT id, text, timestamp FROM messages WHERE id > ? ORDER BY id LIMIT ?',
+                               (watermark, max_messages))
+                messages = cursor.fetchall()
+            if not messages:
+                result.set_result(None)
+                return result
+
+            first_message_id, last_message_id = messages[0][0], messages[-1][0]
+            start_time = min(msg[2] for msg in messages)
+            end_time = max(msg[2] for msg in messages)
+            self.pending_watermark = last_message_id
+
+        def release_watermark():
+            # Let the next summary cover these messages again
+            with self.summary_lock:
+                if self.pending_watermark == last_message_id:
+                    self.pending_watermark = None
+
+        def add_summary(summary):
+            try:
+                self.add_conversation_summary(summary, start_time, end_time, first_message_id, last_message_id)
+            except Exception:
+                release_watermark()
+                raise
+
+        def store(job):
+            try:
+                summary = job.result()
+                # Store the summary, in the background when a write-behind queue is given
+                if write_queue is not None:
+                    write_queue.call(add_summary, summary)
+                else:
+                    add_summary(summary)
+            except Exception as e:
+                release_watermark()
+                result.set_exception(e)
+            else:
+                result.set_result(summary)
+
+        texts = [msg[1] for msg in messages]
+        if previous_summary:
+            texts.insert(0, previous_summary)
+        job = self.summary_pool.submit(summary_pool.summarize_conversation, texts)
+        job.add_done_callback(store)
+        return result
+
+    def get_summary_watermark(self):
+        """Return ``(last summarised message id, that summary's text)``; the id is None if nothing is recorded."""
         cursor = self.get_connection().cursor()
-        cursor.execute('SELECT text, timestamp FROM messages ORDER BY timestamp DESC LIMIT ?', (max_messages,))
-        messages = cursor.fetchall()
-        default_summary = "No messages to summarize"
-        if not messages:
-            return  default_summary
-
-        # Combine messages into a single text
-        conversation_text = " ".join([msg[0] for msg in messages])
-
-        # Use BART to create a summary
-        inputs = self.bart_tokenizer([conversation_text], max_length=1024, return_tensors='pt', truncation=True)
-        summary_ids = self.bart_model.generate(inputs['input_ids'], num_beams=4, max_length=150, early_stopping=True)
-        summary = self.bart_tokenizer.decode(summary_ids[0], skip_special_tokens=True)
-
-        # Get start and end times
-        start_time = messages[-1][1]  # Oldest message
-        end_time = messages[0][1]  # Newest message
-
-        # Store the summary
-        self.add_conversation_summary(summary, start_time, end_time)
+        cursor.execute('SELECT last_message_id, summary FROM conversation_summaries '
+                       'WHERE last_message_id IS NOT NULL ORDER BY last_message_id DESC LIMIT 1')
+        row = cursor.fetchone()
+        watermark, summary = row if row else (None, None)
+        # A summary may still be in the worker or the write-behind queue
+        if self.pending_watermark is not None and (watermark is None or self.pending_watermark > watermark):
+            watermark = self.pending_watermark
+        return watermark, summary
+
+    def add_conversation_summary(self, summary, start_time, end_time, first_message_id=None, last_message_id=None):
+        def insert(conn, model, blobs):
+            conn.execute(
+                'INSERT INTO conversation_summaries (summary, embedding, embedding_model, start_time, end_time, '
+                'first_message_id, last_message_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (summary, blobs[0], model, start_time, end_time, first_message_id, last_message_id))
+
+        self.insert_embedded([summary], insert)
+
+    def get_messages_between(self, start=None, end=None, limit=None):
+        """Messages with ``start <= timestamp <= end``, oldest first.
+
+        Bounds may be datetimes (naive ones are taken as local time) or UTC
+        'YYYY-MM-DD HH:MM:SS' strings; either may be None for an open range.
+        """
+        query = 'SELECT id, text, timestamp FROM messages WHERE timestamp >= ? AND timestamp <= ? ORDER BY timestamp'
+        params = [to_db_time(start) or MIN_TIME, to_db_time(end) or MAX_TIME]
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        cursor = self.get_connection().cursor()
+        cursor.execute(query, params)
+        return [{"id": row[0], "content": row[1], "timestamp": row[2]} for row in cursor.fetchall()]
 
-        return summary
+    def get_summaries_between(self, start=None, end=None, conversation=True):
+        """Summaries whose time range overlaps ``[start, end]``, oldest first.
 
-    def add_conversation_summary(self, summary, start_time, end_time):
-        embedding = self.model.encode([summary])[0]
+        ``conversation`` selects conversation_summaries (the periodic
+        summaries) rather than the summaries table.
+        """
+        table = 'conversation_summaries' if conversation else 'summaries'
         cursor = self.get_connection().cursor()
-        cursor.execute(
-            'INSERT INTO conversation_summaries (summary, embedding, start_time, end_time) VALUES (?, ?, ?, ?)',
-            (summary, embedding.tobytes(), start_time, end_time))
-        self.get_connection().commit()
+        cursor.execute(f'SELECT id, summary, start_time, end_time FROM {table} '
+                       'WHERE end_time >= ? AND start_time <= ? ORDER BY end_time',
+                       (to_db_time(start) or MIN_TIME, to_db_time(end) or MAX_TIME))
+        return [{"id": row[0], "summary": row[1], "start_time": row[2], "end_time": row[3]}
+                for row in cursor.fetchall()]
 
     def get_latest_conversation_summary(self):
         cursor = self.get_connection().cursor()
@@ -136,88 +542,75 @@ class EnhancedVectorDatabase:
         return result[0] if result else None
 
     def create_summary(self, messages, method="tfidf", num_sentences=5):
-        if method == "tfidf":
-            return self.create_summary_tfidf(messages, num_sentences)
-        elif method == "textrank":
-            return self.create_summary_text_rank(messages, num_sentences)
-        elif method == "bart":
-            return self.create_summary_bart(messages, num_sentences)
-        elif method == "clustering":
-            return self.create_summary_clustering(messages, num_sentences)
-        else:
+        return self.submit_summary(messages, method, num_sentences).result()
+
+    def submit_summary(self, messages, method="tfidf", num_sentences=5):
+        """Summarise ``messages`` in the summary worker process; returns a Future of the summary."""
+        if method not in summary_pool.SUMMARY_METHODS:
             raise ValueError("Unsupported summarization method")
+        return self.summary_pool.submit(summary_pool.summarize, method, list(messages), num_sentences)
 
     def create_summary_tfidf(self, messages, num_sentences=3):
-        text = " ".join(messages)
-        sentences = text.split('. ')
-        vectorizer = TfidfVectorizer().fit_transform(sentences)
-        vectors = vectorizer.toarray()
-        cosine_matrix = cosine_similarity(vectors)
-        scores = cosine_matrix.sum(axis=1)
-        ranked_sentences = [sentences[i] for i in np.argsort(scores, axis=0)[::-1]]
-        summary = ". ".join(ranked_sentences[:num_sentences])
-        return summary
+        return self.create_summary(messages, "tfidf", num_sentences)
 
     def create_summary_text_rank(self, messages, num_sentences=3):
-        text = " ".join(messages)
-        summary = summarizer.summarize(text, words=50)
-        return summary
+        return self.create_summary(messages, "textrank", num_sentences)
 
     def create_summary_bart(self, messages, num_sentences=3):
-        model_name = 'facebook/bart-large-cnn'
-        model = BartForConditionalGeneration.from_pretrained(model_name)
-        tokenizer = BartTokenizer.from_pretrained(model_name)
-        text = " ".join(messages)
-        inputs = tokenizer([text], max_length=1024, return_tensors='pt', truncation=True)
-        summary_ids = model.generate(inputs['input_ids'], num_beams=4, max_length=1024, early_stopping=True)
-        summary = tokenizer.decode(summary_ids[0], skip_special_tokens=True)
-        return summary
+        return self.create_summary(messages, "bart", num_sentences)
 
     def create_summary_clustering(self, messages, num_sentences=5):
-        text = " ".join(messages)
-        sentences = text.split('. ')
-        vectorizer = TfidfVectorizer().fit_transform(sentences)
-        vectors = vectorizer.toarray()
-        kmeans = KMeans(n_clusters=num_sentences, random_state=0).fit(vectors)
-        cluster_centers = kmeans.cluster_centers_
-        closest = np.argsort(cosine_similarity(cluster_centers, vectors), axis=1)
-        summary = ". ".join([sentences[i] for i in closest[:, -1]])
-        return summary
+        return self.create_summary(messages, "clustering", num_sentences)
 
     def search_similar(self, query, top_k=5):
-        query_embedding = self.model.encode([query])[0]
+        """Top ``top_k`` of the 1000 most recent messages as ``(id, text, similarity)`` tuples."""
+        query_embedding = self.embed_query(query)
         cursor = self.get_connection().cursor()
-        cursor.execute('SELECT id, text, embedding FROM messages ORDER BY timestamp DESC LIMIT 1000')
-        results = []
-        for row in cursor.fetchall():
-            db_embedding = np.frombuffer(row[2], dtype=np.float32)
-            similarity = cosine_similarity([query_embedding], [db_embedding])[0][0]
-            results.append((row[0], row[1], similarity))
-        results.sort(key=lambda x: x[2], reverse=True)
+        cursor.execute('SELECT id FROM messages ORDER BY timestamp DESC LIMIT 1000')
+        recent_ids = sorted(row[0] for row in cursor.fetchall())
+        results = self._search_matrix('messages', query_embedding, top_k, ids=recent_ids) if recent_ids else []
         logger.info(f"Found {len(results)} similar messages")
-        print(results[:top_k])
-        return results[:top_k]
+        print(results)
+        return results
 
     def add_summary(self, summary, start_time, end_time):
-        embedding = self.model.encode([summary])[0]
-        cursor = self.get_connection().cursor()
-        cursor.execute('INSERT INTO summaries (summary, embedding, start_time, end_time) VALUES (?, ?, ?, ?)',
-                       (summary, embedding.tobytes(), start_time, end_time))
-        self.get_connection().commit()
+        def insert(conn, model, blobs):
+            conn.execute('INSERT INTO summaries (summary, embedding, embedding_model, start_time, end_time) '
+                         'VALUES (?, ?, ?, ?, ?)', (summary, blobs[0], model, start_time, end_time))
+
+        self.insert_embedded([summary], insert)
+        if len(self.matrices['summaries']):
+            self._sync_matrix('summaries')
 
     def get_relevant_summaries(self, query, top_k=3):
-        query_embedding = self.model.encode([query])[0]
-        cursor = self.get_connection().cursor()
-        cursor.execute('SELECT id, summary, embedding FROM summaries')
-        results = []
-        for row in cursor.fetchall():
-            db_embedding = np.frombuffer(row[2], dtype=np.float32)
-            similarity = cosine_similarity([query_embedding], [db_embedding])[0][0]
-            results.append((row[0], row[1], similarity))
-        results.sort(key=lambda x: x[2], reverse=True)
-        return results[:top_k]
+        query_embedding = self.embed_query(query)
+        return self._search_matrix('summaries', query_embedding, top_k)
+
+    def migrate_embeddings(self, vacuum=True):
+        """Rewrite stored embeddings in this database's storage format; returns the number rewritten."""
+        conn = self.get_connection()
+        count = vector_codec.migrate(conn, list(EMBEDDED_COLUMNS), self.storage)
+        if vacuum and count:
+            conn.execute('VACUUM')
+        for table in TEXT_COLUMNS:
+            self.invalidate_matrix(table)
+        return count
 
     def close(self):
-        if hasattr(self._local, 'conn'):
-            self._local.conn.close()
-            del self._local.conn
+        self.summary_pool.shutdown()
+        for matrix in self.matrices.values():
+            matrix.save_index()
+        connections.close(self.db_path)
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_shared_database(db_path='enhanced_chatbot.db'):
+    """Return the process-wide EnhancedVectorDatabase for ``db_path``."""
+    key = os.path.abspath(db_path)
+    with _databases_lock:
+        if key not in _databases:
+            _databases[key] = EnhancedVectorDatabase(db_path)
+        return _databases[key]
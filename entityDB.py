@@ -6,8 +6,11 @@ from tavily import TavilyClient
 import logging
 from typing import Dict, Any, List, Optional
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+import embedding_service
+import entity_snapshot
+import entity_storage
+import entity_vector_store
+import write_behind
 
 load_dotenv()
 tavily = TavilyClient(api_key=os.getenv('TAVILY_API_KEY'))
@@ -18,55 +21,78 @@ class EntityDB:
         self.db_folder = db_folder
         if not os.path.exists(self.db_folder):
             os.makedirs(self.db_folder)
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.vector_file = os.path.join(self.db_folder, "entity_vectors.json")
-        self.load_vectors()
-
-    def load_vectors(self):
-        if os.path.exists(self.vector_file):
-            with open(self.vector_file, 'r') as f:
-                self.entity_vectors = json.load(f)
-        else:
-            self.entity_vectors = {}
+        self.vectors = entity_vector_store.get_store(self.db_folder)
+        self.storage = entity_storage.get_storage(self.db_folder)
+
+    def vectorize_entity(self, entity_name: str, entity_data: Dict[str, Any], fields=None):
+        self.vectorize_entities({entity_name: entity_data}, {entity_name: fields})
+
+    def vectorize_entities(self, entities: Dict[str, Dict[str, Any]], fields: Optional[Dict[str, Any]] = None):
+        """Embed each entity field by field, re-encoding only ``fields[name]`` (all fields if None or missing).
 
-    def save_vectors(self):
-        with open(self.vector_file, 'w') as f:
-            json.dump(self.entity_vectors, f)
+        Vectors of fields that were re-encoded into fewer chunks or no longer
+        exist are removed, as is the single whole-entity vector older stores kept.
+        """
+        fields = dict(fields or {})
+        texts = {}
+        for name, data in entities.items():
+            if fields.get(name) is not None and not any(
+                    entity_storage.split_key(key)[1] for key in self.vectors.group(name)):
+                # No field vectors yet (never embedded, or embedded whole): embed every field
+                fields[name] = None
+            texts.update(entity_storage.field_texts(name, data, fields.get(name)))
+        keys = list(texts)
+        while True:
+            self.vectors.refresh()
+            model = self.vectors.model
+            vectors = embedding_service.encode([texts[key] for key in keys], model_name=model) if keys else []
+            with self.vectors.write_lock():
+                # Encode again if the store was swapped to another model meanwhile
+                if self.vectors.model != model:
+                    continue
+                stale = []
+                for name, data in entities.items():
+                    changed = fields.get(name)
+                    for key in self.vectors.group(name):
+                        field = entity_storage.split_key(key)[1]
+                        if key not in texts and (field is None or field not in data
+                                                 or changed is None or field in changed):
+                            stale.append(key)
+                self.vectors.delete_many(stale)
+                self.vectors.set_many(zip(keys, vectors))
+                return
 
-    def vectorize_entity(self, entity_name: str, entity_data: Dict[str, Any]):
-        entity_text = json.dumps(entity_data)
-        vector = self.model.encode([entity_text])[0].tolist()
-        self.entity_vectors[entity_name] = vector
-        self.save_vectors()
+    def import_entities(self, path: str, batch_size: int = 256) -> int:
+        """Bulk-load entities from a snapshot or JSONL file (see entity_snapshot)."""
+        return entity_snapshot.import_entities(self, path, batch_size)
+
+    def export_snapshot(self, path: str) -> int:
+        """Write all entities and their vectors to a compressed snapshot at ``path``."""
+        return entity_snapshot.export_snapshot(self, path)
 
     @staticmethod
     def create_entity(entity_name: str, field: Optional[Dict[str, Any]] = None,
                       value: Optional[Dict[str, Any]] = None) -> None:
-        db_folder = "entity_db"
         entity_data = {}
         if field:
             entity_data.update(field)
         if value:
             entity_data.update(value)
 
-        entity_file = os.path.join(db_folder, f"{entity_name}.json")
-
-        with open(entity_file, 'w') as f:
-            json.dump(entity_data, f, indent=4)
+        entity_storage.get_storage().write(entity_name, entity_data)
 
         print(f"Entity '{entity_name}' created in the database.")
 
         # Vectorize the entity
-        db = EntityDB()
-        db.vectorize_entity(entity_name, entity_data)
-        print(f"Entity '{entity_name}' vectorized.")
+        write_behind.get_queue().vectorize_entity(EntityDB(), entity_name, entity_data)
+        print(f"Entity '{entity_name}' queued for vectorization.")
 
     @staticmethod
     def search_entities(query: str) -> List[str]:
-        db_folder = "entity_db"
         print(f"Searching for entities matching the query: '{query}'")
-        results = [file.replace(".json", "") for file in os.listdir(db_folder) if
-                   file.endswith(".json") and query in file.replace(".json", "")]
+        storage = entity_storage.get_storage()
+        # Fall back to matching words in names and field values when no name contains the query
+        results = storage.search(query) or storage.full_text_search(query)
         if results:
             print(results)
             EntityDB.read_entity(query)
@@ -77,13 +103,9 @@ class EntityDB:
 
     @staticmethod
     def read_entity(entity_name: str) -> Dict[str, Any]:
-        db_folder = "entity_db"
-        entity_file = os.path.join(db_folder, f"{entity_name}.json")
-
         try:
-            if os.path.exists(entity_file):
-                with open(entity_file, 'r', encoding='utf-8') as f:
-                    entity_data = json.load(f)
+            entity_data = entity_storage.get_storage().read(entity_name)
+            if entity_data is not None:
                 print(f"Successfully read entity: {entity_name}")
                 print(entity_data)
                 return {"status": "success", "data": entity_data}
@@ -99,52 +121,40 @@ class EntityDB:
 
     @staticmethod
     def update_entity(entity_name: str, **fields):
-        db_folder = "entity_db"
-        entity_file = os.path.join(db_folder, f"{entity_name}.json")
-        if os.path.exists(entity_file):
-            with open(entity_file, 'r') as f:
-                entity_data = json.load(f)
-            entity_data.update(fields)
-            with open(entity_file, 'w') as f:
-                json.dump(entity_data, f, indent=4)
+        storage = entity_storage.get_storage()
+        if storage.exists(entity_name):
+            entity_data = storage.set_fields(entity_name, fields)
 
             print(f"Entity '{entity_name}' updated in the database.")
 
-            # Re-vectorize the entity
-            db = EntityDB()
-            db.vectorize_entity(entity_name, entity_data)
-            print(f"Entity '{entity_name}' re-vectorized.")
+            # Re-vectorize the updated fields
+            write_behind.get_queue().vectorize_entity(EntityDB(), entity_name, entity_data, set(fields))
+            print(f"Entity '{entity_name}' queued for re-vectorization.")
         else:
             print(f"Entity '{entity_name}' not found in the database. Update failed.")
 
     @staticmethod
     def delete_entity(entity_name: str) -> None:
-        db_folder = "entity_db"
         confirm_deletion = input(
             f"Are you sure you want to delete entity '{entity_name}' from the database? (yes/no): ")
         if confirm_deletion.lower() != "yes":
             print("Deletion cancelled.")
             return
 
-        entity_file = os.path.join(db_folder, f"{entity_name}.json")
-        if os.path.exists(entity_file):
-            os.remove(entity_file)
+        if entity_storage.get_storage().delete(entity_name):
             print(f"Entity '{entity_name}' deleted from the database.")
 
             # Remove from vector store
-            db = EntityDB()
-            if entity_name in db.entity_vectors:
-                del db.entity_vectors[entity_name]
-                db.save_vectors()
-                print(f"Entity '{entity_name}' removed from vector store.")
+            # Queued behind any pending vectorization of the same entity
+            write_behind.get_queue().call(EntityDB().vectors.delete_group, entity_name)
+            print(f"Entity '{entity_name}' queued for removal from vector store.")
         else:
             print(f"Entity '{entity_name}' not found in the database. Deletion failed.")
 
     @staticmethod
     def list_entities() -> List[str]:
-        db_folder = "entity_db"
         print("Listing entities in the database:")
-        entities = [file.replace(".json", "") for file in os.listdir(db_folder) if file.endswith(".json")]
+        entities = entity_storage.get_storage().names()
         if entities:
             print(entities)
             return entities
@@ -174,26 +184,13 @@ class EntityDB:
     @staticmethod
     def add_field(entity_name: str, field_name: str, field_value: str) -> Dict[str, Any]:
         print("add_field invoked")
-        db_folder = "entity_db"
-        entity_file = os.path.join(db_folder, f"{entity_name}.json")
-
-        if os.path.exists(entity_file):
-            with open(entity_file, 'r') as f:
-                entity_data = json.load(f)
-        else:
-            entity_data = {}
-
-        entity_data[field_name] = field_value
-
-        with open(entity_file, 'w') as f:
-            json.dump(entity_data, f, indent=4)
+        entity_data = entity_storage.get_storage().set_fields(entity_name, {field_name: field_value})
 
         print(f"Field '{field_name}' added to entity '{entity_name}'.")
 
-        # Re-vectorize the entity
-        db = EntityDB()
-        db.vectorize_entity(entity_name, entity_data)
-        print(f"Entity '{entity_name}' re-vectorized.")
+        # Re-vectorize the new field
+        write_behind.get_queue().vectorize_entity(EntityDB(), entity_name, entity_data, {field_name})
+        print(f"Entity '{entity_name}' queued for re-vectorization.")
 
         return entity_data
 
@@ -207,32 +204,43 @@ class EntityDB:
             return {"error": f"Error performing search: {str(e)}"}
 
     def semantic_search(self, query: str = "tony", top_k: int = 5) -> List[Dict[str, Any]]:
-        query_vector = self.model.encode([query])[0]
-
-        similarities = []
-        for entity_name, entity_vector in self.entity_vectors.items():
-            similarity = cosine_similarity([query_vector], [entity_vector])[0][0]
-            similarities.append((entity_name, similarity))
-
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        top_results = similarities[:top_k]
-
+        self.vectors.refresh()
+        query_vector = embedding_service.encode_one(query, model_name=self.vectors.model)
+
+        # Entities have a vector per field chunk and score as their best one, so
+        # widen the search until it covers top_k distinct entities
+        k = top_k * 4
+        while True:
+            hits = self.vectors.search(query_vector, k)
+            best = {}
+            for key, similarity in hits:
+                entity_name, field = entity_storage.split_key(key)
+                if entity_name not in best:
+                    best[entity_name] = (similarity, field)
+            if len(best) >= top_k or len(hits) < k:
+                break
+            k *= 4
+        best = dict(list(best.items())[:top_k])
+
+        entities = self.storage.read_many(best)
         results = []
-        for entity_name, similarity in top_results:
-            entity_file = os.path.join(self.db_folder, f"{entity_name}.json")
-            with open(entity_file, 'r') as f:
-                entity_data = json.load(f)
+        for entity_name, (similarity, field) in best.items():
+            if entity_name not in entities:
+                continue
+            entity_data = entities[entity_name]
             results.append({
                 "entity_name": entity_name,
                 "similarity": similarity,
+                "field": field,
                 "data": entity_data
             })
 
         formatted_results = "\n\n".join(
-            [f"entity_name: {r['entity_name']}\nsimilarity: {r['similarity']:.2f}\ndata: {r['data']}" for r in results]
+            [f"entity_name: {r['entity_name']}\nfield: {r['field']}\nsimilarity: {r['similarity']:.2f}\n"
+             f"data: {r['data']}" for r in results]
         )
         print(formatted_results)
-        return formatted_results
+        return results
 
     @staticmethod
     def local_search(query: str):
@@ -247,15 +255,24 @@ class EntityDB:
         """
         try:
             print(f"Performing local search for {query} ...")
+            # Imported here to keep the tool module free of the summariser dependencies
+            from enhance_vectordb import get_shared_database
+
             db = EntityDB()
             vector_results = db.semantic_search(query, top_k=5)
+            message_results = get_shared_database().hybrid_search(query, k=5)
 
             # Prepare results
             results = {
                 "query": query,
                 "vector_results": [
-                    {"similarity": r['similarity'], "entity_name": r['entity_name'], "data": r['data']}
+                    {"similarity": r['similarity'], "entity_name": r['entity_name'], "field": r['field'],
+                     "data": r['data']}
                     for r in vector_results
+                ],
+                "message_results": [
+                    {"score": r['score'], "source": r['source'], "content": r['content']}
+                    for r in message_results
                 ]
             }
 
@@ -263,7 +280,10 @@ class EntityDB:
             context = f"You searched for '{query}'. Here are the relevant results:\n"
 
             context += "Vector DB results:\n" + "\n".join(
-                [f"{r['similarity']:.2f} - {r['entity_name']}: {r['data']}" for r in results["vector_results"]])
+                [f"{r['similarity']:.2f} - {r['entity_name']} (matched {r['field']}): {r['data']}"
+                 for r in results["vector_results"]])
+            context += "\nConversation history results:\n" + "\n".join(
+                [f"{r['score']:.3f} ({r['source']}) - {r['content']}" for r in results["message_results"]])
             context += "\nBased on these search results, please provide a summary or answer any questions the user might have."
 
             results["context"] = context
@@ -0,0 +1,302 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process is assumed to use the folder
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FILE = "entities.journal"
+# Set ENTITY_JOURNAL=0 to write every mutation straight to the storage engine
+ENTITY_JOURNAL = os.getenv('ENTITY_JOURNAL', '1') != '0'
+COMPACT_INTERVAL = 2.0
+
+
+def fsync_dir(path):
+    """Make renames in the directory ``path`` durable, where the platform allows it."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class EntityJournal:
+    """Append-only log of entity mutations in front of an entity storage engine.
+
+    Mutations are applied to an in-memory view and appended to
+    ``entities.journal`` as JSON lines: ``{"name", "fields"}`` for field
+    writes, ``{"name", "data"}`` for whole entities (null for a deletion).
+    Each mutation returns once its record is fsynced. Commits are grouped:
+    the first waiting caller writes every record appended so far with one
+    fsync, and callers that arrive during it are covered by the next one.
+    A field write costs one appended line rather than a rewrite of the
+    entity. Every ``compact_interval`` a background thread writes the view
+    to the engine (atomically, see ``JsonEntityStorage.write_many``) and replaces
+    the journal by the records still pending. A journal left by a crash is
+    replayed on open.
+
+    It offers the engine's interface and can be used in its place. Only the
+    process holding ``entities.journal.lock`` journals a folder; others
+    write to the engine directly and see journaled changes once compacted.
+    """
+
+    def __init__(self, storage, lock_file=None, compact_interval=COMPACT_INTERVAL):
+        self.storage = storage
+        self.lock_file = lock_file
+        self.path = os.path.join(storage.db_folder, JOURNAL_FILE)
+        self.compact_interval = compact_interval
+        self.lock = threading.RLock()
+        self.flush_lock = threading.RLock()
+        self.overlay = {}
+        self.buffer = []
+        # Sequence numbers of the last record appended and the last one fsynced
+        self.appended = 0
+        self.synced = 0
+        self.replay()
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.running = True
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="EntityJournal", daemon=True)
+        self.thread.start()
+
+    def __getattr__(self, name):
+        storage = self.__dict__.get('storage')
+        if storage is None:
+            raise AttributeError(name)
+        return getattr(storage, name)
+
+    def replay(self):
+        """Rebuild the in-memory view from a journal that was not compacted."""
+        self.overlay = read_journal(self.path, self.storage.read)
+        if self.overlay:
+            logger.info(f"Replayed journaled changes to {len(self.overlay)} entities from {self.path}")
+
+    def _append(self, record):
+        """Apply ``record`` to the view and queue it for writing; returns ``(new data, sequence number)``."""
+        with self.lock:
+            data = _apply_record(self.overlay, record, self.storage.read)
+            self.buffer.append(record)
+            self.appended += 1
+            return data, self.appended
+
+    def _record(self, record):
+        """Apply ``record`` and return the entity's new data once the record is on disk."""
+        data, sequence = self._append(record)
+        self.sync(sequence)
+        return data
+
+    def exists(self, name):
+        with self.lock:
+            if name in self.overlay:
+                return self.overlay[name] is not None
+        return self.storage.exists(name)
+
+    def read(self, name):
+        with self.lock:
+            if name in self.overlay:
+                data = self.overlay[name]
+                return None if data is None else dict(data)
+        return self.storage.read(name)
+
+    def read_many(self, names):
+        names = list(names)
+        entities = {}
+        rest = []
+        with self.lock:
+            for name in names:
+                if name not in self.overlay:
+                    rest.append(name)
+                elif self.overlay[name] is not None:
+                    entities[name] = dict(self.overlay[name])
+        entities.update(self.storage.read_many(rest))
+        return entities
+
+    def write(self, name, data):
+        self._record({"name": name, "data": dict(data)})
+
+    def write_many(self, entities):
+        """Write a batch straight to the engine after compacting, rather than journaling every entity."""
+        with self.flush_lock:
+            self.compact()
+            self.storage.write_many(entities)
+
+    def set_fields(self, name, fields):
+        return dict(self._record({"name": name, "fields": fields}))
+
+    def delete(self, name):
+        with self.lock:
+            existed = self.exists(name)
+            if existed:
+                _, sequence = self._append({"name": name, "data": None})
+        # Not under self.lock: flush takes flush_lock first and then self.lock
+        if existed:
+            self.sync(sequence)
+        return existed
+
+    def names(self):
+        with self.lock:
+            overlay = dict(self.overlay)
+        names = set(self.storage.names())
+        names.difference_update(name for name, data in overlay.items() if data is None)
+        names.update(name for name, data in overlay.items() if data is not None)
+        return sorted(names)
+
+    def search(self, query):
+        return [name for name in self.names() if query in name]
+
+    def full_text_search(self, query, limit=20):
+        self.compact()
+        return self.storage.full_text_search(query, limit)
+
+    def modified_since(self, timestamp):
+        self.compact()
+        return self.storage.modified_since(timestamp)
+
+    def sync(self, sequence):
+        """Wait until the record numbered ``sequence`` is fsynced, writing it along with any others pending."""
+        with self.flush_lock:
+            if self.synced < sequence:
+                self.flush()
+
+    def flush(self):
+        """Write and fsync the records appended so far."""
+        with self.flush_lock:
+            with self.lock:
+                records, self.buffer = self.buffer, []
+                sequence = self.appended
+            if records:
+                self.file.write("".join(json.dumps(record) + "\n" for record in records))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            self.synced = sequence
+
+    def compact(self):
+        """Write the in-memory view to the storage engine and shrink the journal to what is still pending."""
+        with self.flush_lock:
+            self.flush()
+            with self.lock:
+                snapshot = dict(self.overlay)
+            if not snapshot:
+                return
+            self.storage.write_many({name: data for name, data in snapshot.items() if data is not None})
+            for name, data in snapshot.items():
+                if data is None:
+                    self.storage.delete(name)
+            self.storage.sync()
+
+            with self.lock:
+                for name, data in snapshot.items():
+                    if name in self.overlay and self.overlay[name] is data:
+                        del self.overlay[name]
+                # Entities changed during the write stay journaled; their latest state
+                # covers the records appended meanwhile
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    for name, data in self.overlay.items():
+                        f.write(json.dumps({"name": name, "data": data}) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.file.close()
+                os.replace(tmp_path, self.path)
+                fsync_dir(self.storage.db_folder)
+                self.file = open(self.path, 'a', encoding='utf-8')
+                self.buffer = []
+                self.synced = self.appended
+            logger.debug(f"Compacted {len(snapshot)} journaled entities into {self.storage.db_folder}")
+
+    def _run(self):
+        last_compact = time.monotonic()
+        while self.running:
+            self.wakeup.wait(self.compact_interval)
+            try:
+                if self.overlay and time.monotonic() - last_compact >= self.compact_interval:
+                    self.compact()
+                    last_compact = time.monotonic()
+            except Exception:
+                logger.exception(f"Entity journal {self.path} failed")
+
+    def close(self):
+        if not self.running:
+            return
+        self.running = False
+        self.wakeup.set()
+        self.thread.join()
+        self.compact()
+        self.file.close()
+
+
+def _apply_record(overlay, record, read):
+    name = record["name"]
+    if "fields" in record:
+        data = dict((overlay[name] if name in overlay else read(name)) or {})
+        data.update(record["fields"])
+    else:
+        data = record["data"]
+    # A new object per mutation, so compaction can tell whether an entry changed
+    overlay[name] = None if data is None else dict(data)
+    return data
+
+
+def read_journal(path, read):
+    """Replay the journal at ``path`` over entities fetched with ``read``; returns ``{name: data or None}``.
+
+    Other processes can use this to see changes the owning process has not
+    compacted yet.
+    """
+    overlay = {}
+    if not os.path.exists(path):
+        return overlay
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A torn final line from an interrupted write
+                logger.warning(f"Skipping unreadable journal record in {path}")
+                continue
+            _apply_record(overlay, record, read)
+    return overlay
+
+
+_journals = []
+
+
+def open_journal(storage):
+    """Return an EntityJournal for ``storage``, or None if journaling is off or another process owns it."""
+    if not ENTITY_JOURNAL:
+        return None
+    lock_file = open(os.path.join(storage.db_folder, JOURNAL_FILE + ".lock"), 'a')
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            logger.info(f"{storage.db_folder} is journaled by another process, writing directly")
+            return None
+    journal = EntityJournal(storage, lock_file)
+    _journals.append(journal)
+    return journal
+
+
+@atexit.register
+def _close_journals():
+    for journal in _journals:
+        try:
+            journal.close()
+        except Exception:
+            logger.exception(f"Failed to compact entity journal {journal.path}")
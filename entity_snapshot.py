@@ -0,0 +1,166 @@
+import argparse
+import base64
+import datetime
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+import vector_codec
+
+logger = logging.getLogger(__name__)
+
+# A snapshot is gzip-compressed JSON lines: a header record, one record per
+# entity and a footer with the entity count, e.g.
+#   {"format": "entity-snapshot", "version": 1, "model": ..., "dim": ..., "vector_format": ..., "created_at": ...}
+#   {"name": "Websites", "data": {...}, "vectors": [["<vector key>", "<base64 vector_codec blob>"], ...]}
+#   {"count": 1}
+# Plain JSONL files of {"name": ..., "data": ...} records, compressed or not, can be imported too.
+SNAPSHOT_FORMAT = "entity-snapshot"
+SNAPSHOT_VERSION = 1
+COMPRESS_LEVEL = 6
+
+
+def read_records(path):
+    """Yield the records of a JSONL file, gzip-compressed or not; ``-`` reads stdin."""
+    raw = sys.stdin.buffer if path == "-" else open(path, 'rb')
+    try:
+        stream = gzip.GzipFile(fileobj=raw) if raw.peek(2)[:2] == b'\x1f\x8b' else raw
+        for line_number, line in enumerate(io.TextIOWrapper(stream, encoding='utf-8'), 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_number}: {e}") from e
+    finally:
+        if raw is not sys.stdin.buffer:
+            raw.close()
+
+
+def export_snapshot(entity_db, path, vector_format=vector_codec.DEFAULT_FORMAT, batch_size=256):
+    """Write every entity of ``entity_db`` with its field vectors to a snapshot at ``path``.
+
+    Entities are streamed a batch at a time and the file is renamed into
+    place once complete. Returns the number of entities written.
+    """
+    vector_codec.check_format(vector_format)
+    storage, store = entity_db.storage, entity_db.vectors
+    store.refresh()
+    model = store.model
+    count = 0
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=COMPRESS_LEVEL) as f:
+        f.write(json.dumps({
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "model": model,
+            "dim": store.dim,
+            "vector_format": vector_format,
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }) + "\n")
+        names = storage.names()
+        for start in range(0, len(names), batch_size):
+            entities = storage.read_many(names[start:start + batch_size])
+            with store.write_lock():
+                if store.model != model:
+                    raise RuntimeError("Entity vectors were re-encoded during the export; run it again")
+                for name, data in entities.items():
+                    vectors = [[key, base64.b64encode(vector_codec.encode(store.get(key), vector_format)).decode('ascii')]
+                               for key in store.group(name)]
+                    f.write(json.dumps({"name": name, "data": data, "vectors": vectors}) + "\n")
+            count += len(entities)
+        f.write(json.dumps({"count": count}) + "\n")
+    os.replace(tmp_path, path)
+    logger.info(f"Exported {count} entities to {path}")
+    return count
+
+
+def import_entities(entity_db, path, batch_size=256):
+    """Load entities from a snapshot or JSONL file into ``entity_db``, ``batch_size`` at a time.
+
+    Each batch is written with one ``write_many``. Vectors in a snapshot
+    made with the store's embedding model are restored as they are (an empty
+    store adopts the snapshot's model); other entities are embedded in
+    batches. Existing entities with the same names are replaced.
+    Returns the number of entities imported.
+    """
+    store = entity_db.vectors
+    header = None
+    footer = None
+    batch = {}
+    total = 0
+
+    def flush():
+        nonlocal total
+        if not batch:
+            return
+        entity_db.storage.write_many({name: record["data"] for name, record in batch.items()})
+        to_embed = {}
+        with store.write_lock():
+            if header is not None and store.dim is None and header.get("model"):
+                # An empty store adopts the snapshot's model; its dim follows from the first vector
+                store.set_model(header["model"])
+            reuse = header is not None and header.get("model") == store.model and \
+                (store.dim is None or header.get("dim") in (None, store.dim))
+            restored = []
+            for name, record in batch.items():
+                if reuse and record.get("vectors"):
+                    keys = {key for key, _ in record["vectors"]}
+                    store.delete_many([key for key in store.group(name) if key not in keys])
+                    restored.extend((key, vector_codec.decode(base64.b64decode(blob)))
+                                    for key, blob in record["vectors"])
+                else:
+                    to_embed[name] = record["data"]
+            store.set_many(restored)
+        if to_embed:
+            entity_db.vectorize_entities(to_embed)
+        total += len(batch)
+        logger.info(f"Imported {total} entities")
+        batch.clear()
+
+    for record in read_records(path):
+        if "format" in record:
+            if record["format"] != SNAPSHOT_FORMAT or record.get("version", 1) > SNAPSHOT_VERSION:
+                raise ValueError(f"Unsupported snapshot format in {path}: {record['format']} v{record.get('version')}")
+            header = record
+            continue
+        if "name" not in record:
+            if "count" in record:
+                footer = record
+                continue
+            raise ValueError(f"Entity record without a name in {path}")
+        if not isinstance(record.get("data"), dict):
+            raise ValueError(f"Entity '{record['name']}' in {path} has no data object")
+        batch.pop(record["name"], None)
+        batch[record["name"]] = record
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+
+    if header is not None and (footer is None or footer["count"] != total):
+        logger.warning(f"{path} looks truncated: imported {total} entities, "
+                       f"expected {footer['count'] if footer else 'a count footer'}")
+    return total
+
+
+if __name__ == '__main__':
+    from entityDB import EntityDB
+
+    parser = argparse.ArgumentParser(description="Export the entity database to a snapshot or import entities")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="Snapshot to write, or snapshot/JSONL file to read ('-' for stdin)")
+    parser.add_argument("--db", default="entity_db")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--vector-format", default=vector_codec.DEFAULT_FORMAT, choices=list(vector_codec.FORMAT_CODES))
+    args = parser.parse_args()
+
+    db = EntityDB(args.db)
+    if args.command == "export":
+        count = export_snapshot(db, args.path, args.vector_format, args.batch_size)
+        print(f"Exported {count} entities to {args.path}")
+    else:
+        count = import_entities(db, args.path, args.batch_size)
+        print(f"Imported {count} entities from {args.path}")
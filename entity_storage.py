@@ -0,0 +1,427 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import entity_journal
+import entity_vector_store
+from db_connections import connections
+
+logger = logging.getLogger(__name__)
+
+# 'json' keeps one file per entity; 'sqlite' keeps them all in entity_db/entities.db
+ENTITY_STORAGE = os.getenv('ENTITY_STORAGE', 'json')
+SQLITE_FILE = "entities.db"
+# Field values are embedded in chunks of about this many words, below the encoder's input limit
+CHUNK_WORDS = 150
+FIELD_SEPARATOR = "\x1f"
+# Upper bound on the serialised size of the entities kept parsed in memory
+ENTITY_CACHE_BYTES = int(os.getenv('ENTITY_CACHE_BYTES', 64 * 1024 * 1024))
+# JSON files kept in the entity folder that are not entities
+NON_ENTITY_FILES = {entity_vector_store.LEGACY_FILE}
+
+
+def field_texts(entity_name, entity_data, fields=None):
+    """Return ``{vector key: text}`` for the chunks of ``fields`` (default all) of one entity.
+
+    Keys are ``<entity><SEP><field><SEP><chunk>`` so an entity's vectors form
+    one group in the vector store and each points back at its field.
+    """
+    texts = {}
+    for field in (entity_data if fields is None else fields):
+        if field not in entity_data:
+            continue
+        value = entity_data[field]
+        words = (value if isinstance(value, str) else json.dumps(value)).split()
+        for chunk, start in enumerate(range(0, max(len(words), 1), CHUNK_WORDS)):
+            key = FIELD_SEPARATOR.join((entity_name, str(field), str(chunk)))
+            texts[key] = f"{entity_name} {field}: {' '.join(words[start:start + CHUNK_WORDS])}"
+    return texts
+
+
+def split_key(key):
+    """Return ``(entity, field)`` for a vector key; field is None for a whole-entity vector."""
+    parts = key.split(FIELD_SEPARATOR)
+    return parts[0], parts[1] if len(parts) > 1 else None
+
+
+class EntityCache:
+    """LRU cache of parsed entities bounded by their serialised size in bytes.
+
+    Each entry keeps the stamp it was read at (file mtime and size, or the
+    row's update time); ``get`` misses when the caller's current stamp
+    differs, so edits made by other processes are picked up on the next read.
+    """
+
+    def __init__(self, max_bytes=ENTITY_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, name, stamp):
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None or entry[0] != stamp:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(name)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, name, stamp, data, size):
+        with self.lock:
+            self._discard(name)
+            if stamp is None or size > self.max_bytes:
+                return
+            self.entries[name] = (stamp, data, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+
+    def discard(self, name):
+        with self.lock:
+            self._discard(name)
+
+    def _discard(self, name):
+        entry = self.entries.pop(name, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+
+class EntityStorage:
+    """Operations shared by the storage engines, built on their ``read`` and ``write``."""
+
+    def write_many(self, entities):
+        for name, data in entities.items():
+            self.write(name, data)
+
+    def set_fields(self, name, fields):
+        """Set ``fields`` on an entity, creating it if needed; returns its new data."""
+        data = self.read(name) or {}
+        data.update(fields)
+        self.write(name, data)
+        return data
+
+    def sync(self):
+        """Make completed writes durable; engines that sync on write have nothing to do."""
+
+
+class JsonEntityStorage(EntityStorage):
+    """One ``<name>.json`` file per entity in ``db_folder``.
+
+    Parsed entities are cached and revalidated against the file's mtime and
+    size on every read. Reads return a fresh top-level dict, so callers may
+    set fields on it but must not modify nested values in place.
+    """
+
+    def __init__(self, db_folder="entity_db"):
+        self.db_folder = db_folder
+        if not os.path.exists(self.db_folder):
+            os.makedirs(self.db_folder)
+        self.cache = EntityCache()
+
+    def _path(self, name):
+        return os.path.join(self.db_folder, f"{name}.json")
+
+    def _stamp(self, name):
+        try:
+            stat = os.stat(self._path(name))
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def exists(self, name):
+        return os.path.exists(self._path(name))
+
+    def read(self, name):
+        """Return the entity's data, or None if it does not exist."""
+        stamp = self._stamp(name)
+        if stamp is None:
+            self.cache.discard(name)
+            return None
+        data = self.cache.get(name, stamp)
+        if data is None:
+            with open(self._path(name), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.cache.put(name, stamp, data, stamp[1])
+        return dict(data)
+
+    def read_many(self, names):
+        entities = {}
+        for name in names:
+            try:
+                data = self.read(name)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Skipping entity '{name}': {e}")
+                continue
+            if data is not None:
+                entities[name] = data
+        return entities
+
+    def write(self, name, data):
+        self.write_many({name: data})
+
+    def write_many(self, entities):
+        """Write each entity to a temp file and fsync it, then rename them all and fsync the folder once.
+
+        No file is renamed before its contents are on disk, so a crash leaves
+        every entity either old or new.
+        """
+        written = []
+        for name, data in entities.items():
+            tmp_path = self._path(name) + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            written.append((name, data, tmp_path))
+        for name, data, tmp_path in written:
+            os.replace(tmp_path, self._path(name))
+            stamp = self._stamp(name)
+            self.cache.put(name, stamp, dict(data), stamp[1] if stamp else 0)
+        if written:
+            entity_journal.fsync_dir(self.db_folder)
+
+    def delete(self, name):
+        self.cache.discard(name)
+        path = self._path(name)
+        if not os.path.exists(path):
+            return False
+        os.remove(path)
+        return True
+
+    def names(self):
+        return sorted(file[:-len(".json")] for file in os.listdir(self.db_folder)
+                      if file.endswith(".json") and file not in NON_ENTITY_FILES)
+
+    def search(self, query):
+        """Names containing ``query``."""
+        return [name for name in self.names() if query in name]
+
+    def full_text_search(self, query, limit=20):
+        return []
+
+    def modified_since(self, timestamp):
+        return [name for name in self.names() if os.path.getmtime(self._path(name)) >= timestamp]
+
+
+class SqliteEntityStorage(EntityStorage):
+    """All entities in one SQLite database, one row per field, with an FTS5 index.
+
+    ``entities`` holds names and modification times, ``entity_fields`` the
+    fields in insertion order with JSON-encoded values, and ``entity_search``
+    indexes each entity's name and field names and values. On first use the
+    JSON files already in ``db_folder`` are imported; they are left in place,
+    and ``entity_meta`` records the import so it is never repeated.
+    Parsed entities are cached like ``JsonEntityStorage`` does, revalidated
+    against ``updated_at``.
+    """
+
+    def __init__(self, db_folder="entity_db"):
+        self.db_folder = db_folder
+        if not os.path.exists(self.db_folder):
+            os.makedirs(self.db_folder)
+        self.db_path = os.path.abspath(os.path.join(self.db_folder, SQLITE_FILE))
+        self.fts_available = True
+        self.write_lock = threading.Lock()
+        self.cache = EntityCache()
+        conn = self.get_connection()
+        if not conn.execute("SELECT 1 FROM entity_meta WHERE key = 'json_imported'").fetchone():
+            # Databases from before the marker imported the files while the table was empty
+            if not conn.execute('SELECT 1 FROM entities LIMIT 1').fetchone():
+                self.import_json()
+            conn.execute("INSERT OR IGNORE INTO entity_meta (key, value) VALUES ('json_imported', ?)",
+                         (str(time.time()),))
+            conn.commit()
+
+    def get_connection(self):
+        return connections.get(self.db_path, self.create_tables)
+
+    def create_tables(self, conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS entities (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS entity_fields (
+                entity_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                field TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (entity_id, field)
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_entities_updated_at ON entities(updated_at)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS entity_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        ''')
+        try:
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS entity_search "
+                         "USING fts5(name, content, tokenize='porter unicode61')")
+        except sqlite3.OperationalError as e:
+            logger.warning(f"FTS5 unavailable, entity full-text search disabled: {e}")
+            self.fts_available = False
+
+    def import_json(self):
+        """Copy the entities stored as JSON files in ``db_folder`` into the database."""
+        json_storage = JsonEntityStorage(self.db_folder)
+        entities = json_storage.read_many(json_storage.names())
+        if entities:
+            self.write_many(entities)
+            logger.info(f"Imported {len(entities)} JSON entities into {self.db_path}")
+
+    def exists(self, name):
+        return self.get_connection().execute('SELECT 1 FROM entities WHERE name = ?', (name,)).fetchone() is not None
+
+    def read(self, name):
+        return self.read_many([name]).get(name)
+
+    def read_many(self, names):
+        names = list(names)
+        entities = {}
+        conn = self.get_connection()
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            stamps = dict(conn.execute(f'SELECT name, updated_at FROM entities WHERE name IN ({placeholders})',
+                                       chunk).fetchall())
+            missing = []
+            for name, stamp in stamps.items():
+                data = self.cache.get(name, stamp)
+                if data is None:
+                    missing.append(name)
+                else:
+                    entities[name] = dict(data)
+            if not missing:
+                continue
+            loaded = {name: {} for name in missing}
+            sizes = dict.fromkeys(missing, 0)
+            placeholders = ','.join('?' * len(missing))
+            rows = conn.execute(
+                f'SELECT e.name, f.field, f.value FROM entities e JOIN entity_fields f ON f.entity_id = e.id '
+                f'WHERE e.name IN ({placeholders}) ORDER BY e.name, f.position', missing)
+            for name, field, value in rows:
+                loaded[name][field] = json.loads(value)
+                sizes[name] += len(field) + len(value)
+            for name, data in loaded.items():
+                self.cache.put(name, stamps[name], data, sizes[name])
+                entities[name] = dict(data)
+        return entities
+
+    def write(self, name, data):
+        self.write_many({name: data})
+
+    def write_many(self, entities):
+        """Create or replace several entities in one transaction."""
+        conn = self.get_connection()
+        now = time.time()
+        written = {}
+        with self.write_lock:
+            try:
+                for name, data in entities.items():
+                    conn.execute('INSERT INTO entities (name, updated_at) VALUES (?, ?) '
+                                 'ON CONFLICT(name) DO UPDATE SET updated_at = excluded.updated_at', (name, now))
+                    entity_id = conn.execute('SELECT id FROM entities WHERE name = ?', (name,)).fetchone()[0]
+                    conn.execute('DELETE FROM entity_fields WHERE entity_id = ?', (entity_id,))
+                    fields = [(entity_id, position, str(field), json.dumps(value))
+                              for position, (field, value) in enumerate(data.items())]
+                    conn.executemany('INSERT INTO entity_fields (entity_id, position, field, value) VALUES (?, ?, ?, ?)',
+                                     fields)
+                    written[name] = sum(len(field) + len(value) for _, _, field, value in fields)
+                    if self.fts_available:
+                        content = " ".join(f"{field} {value if isinstance(value, str) else json.dumps(value)}"
+                                           for field, value in data.items())
+                        conn.execute('DELETE FROM entity_search WHERE rowid = ?', (entity_id,))
+                        conn.execute('INSERT INTO entity_search (rowid, name, content) VALUES (?, ?, ?)',
+                                     (entity_id, name, content))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                for name in entities:
+                    self.cache.discard(name)
+                raise
+        for name, size in written.items():
+            self.cache.put(name, now, dict(entities[name]), size)
+
+    def delete(self, name):
+        conn = self.get_connection()
+        self.cache.discard(name)
+        with self.write_lock:
+            row = conn.execute('SELECT id FROM entities WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                return False
+            conn.execute('DELETE FROM entity_fields WHERE entity_id = ?', row)
+            conn.execute('DELETE FROM entities WHERE id = ?', row)
+            if self.fts_available:
+                conn.execute('DELETE FROM entity_search WHERE rowid = ?', row)
+            conn.commit()
+            return True
+
+    def sync(self):
+        # With synchronous=NORMAL the latest WAL commits are only synced by a checkpoint
+        self.get_connection().execute('PRAGMA wal_checkpoint(FULL)')
+
+    def names(self):
+        return [row[0] for row in self.get_connection().execute('SELECT name FROM entities ORDER BY name')]
+
+    def search(self, query):
+        """Names containing ``query``."""
+        return [row[0] for row in self.get_connection().execute(
+            'SELECT name FROM entities WHERE instr(name, ?) > 0 ORDER BY name', (query,))]
+
+    def full_text_search(self, query, limit=20):
+        """Names of entities whose name or fields match any word of ``query``, best BM25 first."""
+        terms = re.findall(r'\w+', query)
+        if not terms or not self.fts_available:
+            return []
+        match = " OR ".join(f'"{term}"' for term in terms)
+        return [row[0] for row in self.get_connection().execute(
+            'SELECT name FROM entity_search WHERE entity_search MATCH ? ORDER BY rank LIMIT ?', (match, limit))]
+
+    def modified_since(self, timestamp):
+        return [row[0] for row in self.get_connection().execute(
+            'SELECT name FROM entities WHERE updated_at >= ? ORDER BY name', (timestamp,))]
+
+
+STORAGE_ENGINES = {
+    "json": JsonEntityStorage,
+    "sqlite": SqliteEntityStorage,
+}
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def get_storage(db_folder="entity_db", engine=None):
+    """Return the process-wide entity storage for ``db_folder`` using ``engine`` (default ENTITY_STORAGE).
+
+    Unless ENTITY_JOURNAL is off, writes go through an ``entity_journal.EntityJournal``
+    in the one process that holds the folder's journal.
+    """
+    engine = engine or ENTITY_STORAGE
+    if engine not in STORAGE_ENGINES:
+        raise ValueError(f"Unsupported entity storage engine: {engine}")
+    key = (os.path.abspath(db_folder), engine)
+    with _storages_lock:
+        if key not in _storages:
+            storage = STORAGE_ENGINES[engine](db_folder)
+            _storages[key] = entity_journal.open_journal(storage) or storage
+        return _storages[key]
@@ -0,0 +1,457 @@
+import atexit
+import contextlib
+import json
+import os
+import threading
+import logging
+import numpy as np
+import ann_index
+import embedding_service
+import vector_search
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process is assumed to write the folder
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MATRIX_FILE = "entity_vectors.f32"
+INDEX_FILE = "entity_vectors.idx"
+LEGACY_FILE = "entity_vectors.json"
+ANN_FILE = "entity_vectors.hnsw"
+LOCK_FILE = "entity_vectors.lock"
+# Keys "<group><GROUP_SEPARATOR><rest>" belong to <group>, e.g. the field vectors of one entity
+GROUP_SEPARATOR = "\x1f"
+
+
+def key_group(key):
+    return key.split(GROUP_SEPARATOR, 1)[0]
+
+
+class EntityVectorStore:
+    """Entity vectors kept in a float32 matrix file plus an append-only name index.
+
+    The matrix file holds one fixed-width row per slot and is memory-mapped for
+    reads. The index is a JSON-lines log of ``{"name": ..., "row": ...}`` records
+    (``row`` is null for a deletion) that is replayed on load and compacted
+    once it grows well past the number of live entries. Updating an entity
+    overwrites its row in place; deleted rows are reused by later inserts.
+    Once there are ``ann_threshold`` entities, searches go through an HNSW
+    index labelled by row, which is saved on exit and rebuilt if the files
+    changed after it was saved. The index header records the embedding
+    ``model``; if another process replaces the files (a model swap by
+    reindex.py) the store reloads them on its next access. Writes hold
+    ``entity_vectors.lock`` so they cannot interleave with such a swap.
+    Keys sharing the text before ``GROUP_SEPARATOR`` form a group that can
+    be listed and deleted without scanning the other keys.
+    """
+
+    def __init__(self, db_folder: str = "entity_db", ann_threshold=ann_index.DEFAULT_THRESHOLD, model=None):
+        self.db_folder = db_folder
+        if not os.path.exists(self.db_folder):
+            os.makedirs(self.db_folder)
+        self.matrix_path = os.path.join(self.db_folder, MATRIX_FILE)
+        self.index_path = os.path.join(self.db_folder, INDEX_FILE)
+        self.legacy_path = os.path.join(self.db_folder, LEGACY_FILE)
+        self.lock = threading.RLock()
+        self.dim = None
+        self.model = model or embedding_service.MODEL_NAME
+        self._tracked_model = None
+        self._lock_path = os.path.join(self.db_folder, LOCK_FILE)
+        self._lock_file = None
+        self._lock_depth = 0
+        self.rows = {}
+        self.groups = {}
+        self.free_rows = []
+        self.n_rows = 0
+        self._log_records = 0
+        self._mmap = None
+        self._index_stat = None
+        # Bytes of the index read so far; records other processes append after it are replayed
+        self._index_offset = 0
+        # Unit-length copy of the matrix, one row per slot, built on the first
+        # search and then kept in step with set/delete.
+        self._normalized = None
+        self._live = None
+        self._row_names = []
+        self.ann = ann_index.HnswIndex(os.path.join(self.db_folder, ANN_FILE), threshold=ann_threshold)
+        self.load()
+
+    def load(self):
+        with self.lock:
+            self.rows = {}
+            self._log_records = 0
+            self._index_stat = self._stat_index()
+            records, self._index_offset = self._read_index(0)
+            for record in records:
+                if "dim" in record:
+                    self._read_header(record)
+                    continue
+                self._log_records += 1
+                if record.get("row") is None:
+                    self.rows.pop(record["name"], None)
+                else:
+                    self.rows[record["name"]] = record["row"]
+            self.groups = {}
+            for name in self.rows:
+                self.groups.setdefault(key_group(name), set()).add(name)
+            self._count_rows()
+            self._normalized = None
+            self.ann.reset()
+            self._track_model()
+
+            if not os.path.exists(self.index_path) and os.path.exists(self.legacy_path):
+                self.migrate_legacy()
+
+    def _read_index(self, offset):
+        """Parse the index records from byte ``offset``; returns them and the offset after the last whole line.
+
+        A final line without its newline is left for later: it is either
+        still being written by another process or was torn by a crash.
+        """
+        records = []
+        if not os.path.exists(self.index_path):
+            return records, 0
+        with open(self.index_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A torn line from an interrupted write, ended by the next append
+                    logger.warning(f"Skipping unreadable index record in {self.index_path}")
+        return records, offset
+
+    def _read_header(self, record):
+        self.dim = record["dim"]
+        # Stores written before models were recorded used the default
+        self.model = record.get("model", embedding_service.MODEL_NAME)
+
+    def _count_rows(self):
+        """Take the number of rows from the matrix file and list the ones no key uses."""
+        if self.dim and os.path.exists(self.matrix_path):
+            self.n_rows = os.path.getsize(self.matrix_path) // (self.dim * 4)
+        else:
+            self.n_rows = 0
+        used = set(self.rows.values())
+        self.free_rows = [row for row in range(self.n_rows) if row not in used]
+        self._mmap = None
+
+    def _stat_index(self):
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+    def _track_model(self):
+        if self.model != self._tracked_model:
+            embedding_service.track_model(self._tracked_model, self.model)
+            self._tracked_model = self.model
+
+    def set_model(self, model):
+        """Choose the embedding model of a store that has no vectors yet."""
+        with self.lock:
+            if self.dim is not None and self.model != model:
+                raise ValueError(f"{self.db_folder} already holds {self.model} vectors")
+            self.model = model
+            self._track_model()
+
+    @contextlib.contextmanager
+    def write_lock(self):
+        """Hold the store's lock and, across processes, its lock file; reloads the files if they were swapped."""
+        with self.lock:
+            if self._lock_depth == 0 and fcntl is not None:
+                self._lock_file = open(self._lock_path, 'a')
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                self.refresh()
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and self._lock_file is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def refresh(self):
+        """Catch up with other processes: reload a replaced index file, or replay records appended to it."""
+        with self.lock:
+            if self._stat_index() != self._index_stat:
+                logger.info(f"{self.index_path} was replaced, reloading")
+                self.load()
+                return
+            if self._index_stat is None or os.path.getsize(self.index_path) <= self._index_offset:
+                return
+            records, self._index_offset = self._read_index(self._index_offset)
+            if not records:
+                return
+            changed, freed = {}, []
+            for record in records:
+                if "dim" in record:
+                    self._read_header(record)
+                    continue
+                self._log_records += 1
+                name, row = record["name"], record.get("row")
+                old_row = self.rows.pop(name, None)
+                if old_row is not None:
+                    group = self.groups[key_group(name)]
+                    group.discard(name)
+                    if not group:
+                        del self.groups[key_group(name)]
+                    changed.pop(old_row, None)
+                    freed.append(old_row)
+                if row is not None:
+                    self.rows[name] = row
+                    self.groups.setdefault(key_group(name), set()).add(name)
+                    changed[row] = name
+            self._count_rows()
+            freed = [row for row in freed if row not in changed]
+            if self._normalized is not None:
+                for row in freed:
+                    self._live[row] = False
+                    self._row_names[row] = None
+            self.ann.mark_deleted(freed)
+            matrix = self._matrix()
+            for row, name in changed.items():
+                self._cache_row(row, name, np.array(matrix[row]))
+            self._track_model()
+            logger.debug(f"Replayed {len(records)} index records appended to {self.index_path}")
+
+    def migrate_legacy(self):
+        """Import vectors from the old entity_vectors.json file."""
+        logger.info(f"Migrating {self.legacy_path} to binary vector store")
+        with open(self.legacy_path, 'r') as f:
+            legacy = json.load(f)
+        self.set_many(legacy.items())
+        os.replace(self.legacy_path, self.legacy_path + ".migrated")
+
+    def _append_index(self, records):
+        # Called under write_lock, after refresh(): anything past the offset is a torn line
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            if f.tell() > self._index_offset:
+                f.write("\n")
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            self._index_offset = f.tell()
+        if self._index_stat is None:
+            self._index_stat = self._stat_index()
+        self._log_records += sum(1 for r in records if "dim" not in r)
+        if self._log_records > 2 * len(self.rows) + 1024:
+            self.compact_index()
+
+    def compact_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"dim": self.dim, "model": self.model}) + "\n")
+            for name, row in self.rows.items():
+                f.write(json.dumps({"name": name, "row": row}) + "\n")
+            self._index_offset = f.tell()
+        os.replace(tmp_path, self.index_path)
+        self._index_stat = self._stat_index()
+        self._log_records = len(self.rows)
+        self.save_ann()
+
+    def _ann_state(self):
+        """Tag identifying the current index and matrix files, so a stale saved ANN index is not used."""
+        index_size = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+        matrix_mtime = os.stat(self.matrix_path).st_mtime_ns if os.path.exists(self.matrix_path) else 0
+        return f"{index_size}:{matrix_mtime}"
+
+    def save_ann(self):
+        with self.lock:
+            if self.ann.unsaved:
+                self.ann.save(self._ann_state())
+
+    def set(self, name, vector):
+        self.set_many([(name, vector)])
+
+    def set_many(self, items):
+        """Write ``(name, vector)`` pairs with one open of the matrix file and one index append."""
+        with self.write_lock():
+            records = []
+            f = None
+            try:
+                for name, vector in items:
+                    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+                    if self.dim is None:
+                        self.dim = int(vector.shape[0])
+                        self._append_index([{"dim": self.dim, "model": self.model}])
+                    elif vector.shape[0] != self.dim:
+                        raise ValueError(f"Vector for '{name}' has dimension {vector.shape[0]}, expected {self.dim}")
+
+                    row = self.rows.get(name)
+                    new_row = row is None
+                    if new_row:
+                        row = self.free_rows.pop(0) if self.free_rows else self.n_rows
+
+                    if f is None:
+                        f = open(self.matrix_path, 'r+b' if os.path.exists(self.matrix_path) else 'wb')
+                    f.seek(row * self.dim * 4)
+                    f.write(vector.tobytes())
+                    if row >= self.n_rows:
+                        self.n_rows = row + 1
+                        self._mmap = None
+
+                    if new_row:
+                        self.rows[name] = row
+                        self.groups.setdefault(key_group(name), set()).add(name)
+                        records.append({"name": name, "row": row})
+
+                    self._cache_row(row, name, vector)
+            finally:
+                if f is not None:
+                    f.close()
+                if records:
+                    self._append_index(records)
+
+    def _cache_row(self, row, name, vector):
+        """Bring the search copies (normalized matrix, ANN index) of ``row`` up to date with ``vector``."""
+        if self._normalized is not None:
+            if row >= len(self._normalized):
+                grown = np.zeros((max(row + 1, 2 * len(self._normalized)), self.dim), dtype=np.float32)
+                grown[:len(self._normalized)] = self._normalized
+                self._normalized = grown
+                self._live = np.concatenate([self._live,
+                                             np.zeros(len(grown) - len(self._live), dtype=bool)])
+                self._row_names.extend([None] * (len(grown) - len(self._row_names)))
+            self._normalized[row] = vector_search.normalize(vector)
+            self._live[row] = True
+            self._row_names[row] = name
+        if self.ann.graph is not None:
+            self.ann.add([row], vector.reshape(1, -1))
+
+    def delete(self, name):
+        return self.delete_many([name]) > 0
+
+    def delete_many(self, names):
+        """Delete several keys with one index write; returns how many existed."""
+        with self.write_lock():
+            deleted, deleted_names = [], []
+            for name in names:
+                row = self.rows.pop(name, None)
+                if row is None:
+                    continue
+                group = self.groups.get(key_group(name))
+                group.discard(name)
+                if not group:
+                    del self.groups[key_group(name)]
+                self.free_rows.append(row)
+                if self._normalized is not None:
+                    self._live[row] = False
+                    self._row_names[row] = None
+                deleted.append(row)
+                deleted_names.append(name)
+            if deleted:
+                self._append_index([{"name": name, "row": None} for name in deleted_names])
+                self.ann.mark_deleted(deleted)
+            return len(deleted)
+
+    def group(self, group):
+        """Keys belonging to ``group``."""
+        with self.lock:
+            self.refresh()
+            return sorted(self.groups.get(group, ()))
+
+    def group_names(self):
+        with self.lock:
+            return list(self.groups)
+
+    def delete_group(self, group):
+        return self.delete_many(self.group(group))
+
+    def _matrix(self):
+        if self._mmap is None and self.n_rows:
+            self._mmap = np.memmap(self.matrix_path, dtype=np.float32, mode='r',
+                                   shape=(self.n_rows, self.dim))
+        return self._mmap
+
+    def _ensure_normalized(self):
+        if self._normalized is None:
+            if self.n_rows:
+                self._normalized = vector_search.normalize_rows(np.array(self._matrix()))
+            else:
+                self._normalized = np.zeros((0, self.dim or 0), dtype=np.float32)
+            self._live = np.zeros(len(self._normalized), dtype=bool)
+            self._row_names = [None] * len(self._normalized)
+            for name, row in self.rows.items():
+                self._live[row] = True
+                self._row_names[row] = name
+
+    def _ensure_ann(self):
+        if self.ann.graph is not None or self.ann.load(self.dim, self._ann_state()):
+            return
+        rows = np.fromiter(self.rows.values(), dtype=np.int64, count=len(self.rows))
+        for start in range(0, len(rows), 10000):
+            chunk = rows[start:start + 10000]
+            self.ann.add(chunk, self._normalized[chunk])
+        logger.info(f"Built ANN index over {len(rows)} entity vectors")
+
+    def search(self, query_vector, top_k=5):
+        """Return ``[(name, cosine_similarity), ...]`` for the closest entities."""
+        with self.lock:
+            self.refresh()
+            if not self.rows:
+                return []
+            self._ensure_normalized()
+            if self.ann.wanted(len(self.rows)):
+                self._ensure_ann()
+                hits = self.ann.search(query_vector, top_k)
+                if hits is not None:
+                    return [(self._row_names[row], score) for row, score in hits]
+            scores = self._normalized @ vector_search.normalize(query_vector)
+            scores[~self._live] = -np.inf
+            best = vector_search.top_k(scores, min(top_k, len(self.rows)))
+            return [(self._row_names[i], float(scores[i])) for i in best]
+
+    def get(self, name):
+        with self.lock:
+            self.refresh()
+            row = self.rows.get(name)
+            if row is None:
+                return None
+            return np.array(self._matrix()[row])
+
+    def items(self):
+        with self.lock:
+            self.refresh()
+            matrix = self._matrix()
+            return [(name, np.array(matrix[row])) for name, row in self.rows.items()]
+
+    def names(self):
+        with self.lock:
+            self.refresh()
+            return list(self.rows)
+
+    def __contains__(self, name):
+        return name in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(db_folder: str = "entity_db") -> EntityVectorStore:
+    """Return the process-wide store for ``db_folder``."""
+    key = os.path.abspath(db_folder)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = EntityVectorStore(db_folder)
+        return _stores[key]
+
+
+@atexit.register
+def _save_ann_indexes():
+    for store in list(_stores.values()):
+        store.save_ann()
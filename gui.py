@@ -10,9 +10,11 @@ from PyQt6.QtGui import QFont, QColor
 from PyQt6.QtCore import Qt, QThread, pyqtSignal, QLocale, QTimer
 from model import init_model, send_message_async, get_available_models, DEFAULT_MODEL, DEFAULT_SYSTEM_PROMPT, History
 from dotenv import load_dotenv
-from enhance_vectordb import EnhancedVectorDatabase, logger
+from enhance_vectordb import get_shared_database, logger
 from user_profile import UserProfile
 from personality_system import PersonalityManager
+import write_behind
+from db_connections import connections
 import os
 import datetime
 import pyttsx3
@@ -143,7 +145,6 @@ class ChatWorker(QThread):
             # Get personality prompt
             personality_prompt = self.personality_manager.get_personality_prompt()
             working_directory = os.getcwd()
-            self.entity_db = EntityDB()
 
             # Construct the full message with context
             context = f"User Preferences: {user_preferences}\nTop Topics: {top_topics}\n"
@@ -157,18 +158,20 @@ class ChatWorker(QThread):
             context += f"Working Directory: {working_directory}\n"
             context += "Relevant Entities:\n"
             for result in entity_results:
-                context += f"- {result['entity_name']} (Similarity: {result['similarity']:.2f}): {result['data']}\n"
+                context += (f"- {result['entity_name']} (Similarity: {result['similarity']:.2f}, "
+                            f"matched field: {result['field']}): {result['data']}\n")
 
             context += "\n"
             context += f"Personality: {personality_prompt}\n\n"
             full_message = f"{context}User message: {self.message}"
 
             response = self.chat.send_message(full_message)
-            self.vectordb.add_message(self.message)
-            self.vectordb.add_message(response.text)
+            write_behind.get_queue().add_messages(self.vectordb, [self.message, response.text])
             self.finished.emit(response.text)
         except Exception as e:
             self.error.emit(str(e))
+        finally:
+            connections.release_thread()
 
 
 class SummaryWorker(QThread):
@@ -181,13 +184,38 @@ class SummaryWorker(QThread):
 
     def run(self):
         try:
-            summary = self.vectordb.create_conversation_summary()
+            summary = self.vectordb.create_conversation_summary(write_queue=write_behind.get_queue())
             if summary:
                 self.summary_created.emit(summary)
             else:
                 self.summary_created.emit("")
         except Exception as e:
             self.error_occurred.emit(str(e))
+        finally:
+            connections.release_thread()
+
+
+class RollupWorker(QThread):
+    rollups_built = pyqtSignal(int)
+    error_occurred = pyqtSignal(str)
+
+    def __init__(self, vectordb):
+        super().__init__()
+        self.vectordb = vectordb
+        self.running = True
+
+    def run(self):
+        try:
+            # Make sure queued conversation summaries are in the table first
+            write_behind.get_queue().flush()
+            self.rollups_built.emit(self.vectordb.rollups.build(should_stop=lambda: not self.running))
+        except Exception as e:
+            self.error_occurred.emit(str(e))
+        finally:
+            connections.release_thread()
+
+    def stop(self):
+        self.running = False
 
 
 
@@ -204,7 +232,7 @@ class App(QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Neo Rebis Interface")
-        self.vectordb = EnhancedVectorDatabase('enhanced_chatbot.db')
+        self.vectordb = get_shared_database('enhanced_chatbot.db')
         self.user_profile = UserProfile("default_user")
         self.personality_manager = PersonalityManager()
         self.history = History
@@ -252,6 +280,10 @@ class App(QWidget):
         # Initialize summary worker
         self.summary_worker = None
 
+        # Roll up any days, weeks and months that closed since the last run
+        self.rollup_worker = None
+        self.start_rollup()
+
         self.is_text_changed_connected = True  # Track the connection state
 
 
@@ -365,7 +397,7 @@ class App(QWidget):
     def perform_search(self, query):
         try:
             log_results = self.log_manager.search_logs(query)
-            vector_results = self.vectordb.semantic_search(query, k=5)  # Assuming k=5 for top 5 results
+            vector_results = self.vectordb.hybrid_search(query, k=5)
 
             self.display_message(f"Search results for '{query}':", "System")
 
@@ -375,15 +407,15 @@ class App(QWidget):
                     self.display_message(result, "Log")
 
             if vector_results:
-                self.display_message("Vector DB Semantic Search Results:", "System")
+                self.display_message("Vector DB Hybrid Search Results:", "System")
                 for result in vector_results:
-                    self.display_message(f"Similarity: {result['similarity']:.2f} - {result['content']}", "VectorDB")
+                    self.display_message(f"Score: {result['score']:.3f} ({result['source']}) - {result['content']}", "VectorDB")
 
             # Prepare context for the bot
             context = f"Tony searched for '{query}'. Here are the relevant results:\n"
             context += "Log results:\n" + "\n".join(log_results[:5]) + "\n"
             context += "Vector DB results:\n" + "\n".join(
-                [f"{r['similarity']:.2f} - {r['content']}" for r in vector_results])
+                [f"{r['score']:.3f} ({r['source']}) - {r['content']}" for r in vector_results])
             context += "\nBased on these search results, please provide a summary or answer any questions the user might have."
 
             # Send context to the bot for processing
@@ -640,8 +672,19 @@ class App(QWidget):
         self.summary_worker.error_occurred.connect(self.on_summary_error)
         self.summary_worker.start()
 
+    def start_rollup(self):
+        if self.rollup_worker and self.rollup_worker.isRunning():
+            return
+        self.rollup_worker = RollupWorker(self.vectordb)
+        self.rollup_worker.error_occurred.connect(self.on_rollup_error)
+        self.rollup_worker.start()
+
+    def on_rollup_error(self, error):
+        logger.error(f"Error building summary rollups: {error}")
+
     def on_summary_created(self, summary):
         if summary:
+            self.start_rollup()
             self.chat_display.clear()
             self.display_message("Conversation Summary:", "System")
             self.display_message(summary, "Summary")
@@ -660,17 +703,24 @@ class App(QWidget):
             system_prompt = self.DEFAULT_SYSTEM_PROMPT
         try:
             latest_summary = self.vectordb.get_latest_conversation_summary()
+            summary_prompt = ""
             if latest_summary:
-                summary_prompt = f"\n\nLatest conversation summary: {latest_summary}"
+                # Pull older context relevant to the latest session from the rollup tree
+                memories = self.vectordb.rollups.retrieve(latest_summary, token_budget=1024)
+                if memories:
+                    summary_prompt += "\n\nLong-term memory:\n" + "\n".join(
+                        f"[{m['level']} {m['start']} to {m['end']}] {m['summary']}" for m in memories)
+                summary_prompt += f"\n\nLatest conversation summary: {latest_summary}"
 
             self.chat = init_model(model_name, system_prompt)
             if self.chat:
                 self.display_message("Model initialized! Let's chat!", "System")
-                self.worker = ChatWorker(self.chat, summary_prompt, self.vectordb, self.user_profile,
-                                         self.personality_manager)
-                self.worker.finished.connect(self.process_response)
-                self.worker.error.connect(self.handle_error)
-                self.worker.start()
+                if summary_prompt:
+                    self.worker = ChatWorker(self.chat, summary_prompt, self.vectordb, self.user_profile,
+                                             self.personality_manager)
+                    self.worker.finished.connect(self.process_response)
+                    self.worker.error.connect(self.handle_error)
+                    self.worker.start()
             else:
                 self.display_message("Error initializing model. Check console.", "System")
         except Exception as e:
@@ -685,6 +735,11 @@ class App(QWidget):
 
         if self.summary_worker and self.summary_worker.isRunning():
             self.summary_worker.wait()
+        if self.rollup_worker and self.rollup_worker.isRunning():
+            # Waits for the period being summarised, not the whole backlog
+            self.rollup_worker.stop()
+            self.rollup_worker.wait()
+        write_behind.get_queue().stop()
         self.vectordb.close()
         self.user_profile.save_profile()
         self.log_manager.log_message("System", "Application closed")
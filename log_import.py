@@ -0,0 +1,149 @@
+import argparse
+import datetime
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# Entries are written by LogManager.log_message as "\n[timestamp] sender: message\n"
+ENTRY_PATTERN = re.compile(r'^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\] ([^:\n]+): ?(.*)$')
+# Chat messages carry their own "[timestamp] " prefix inside the logged text
+INNER_TIMESTAMP = re.compile(r'^\[\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\] ')
+SKIPPED_SENDERS = {"System"}
+# Logged by the chat window's closeEvent as the last entry of a session
+CLOSED_MESSAGE = "Application closed"
+# The chat window stores each turn itself, a little after logging it; a log
+# entry with the same text as a message stored this close to it is that turn
+DUPLICATE_WINDOW = datetime.timedelta(minutes=10)
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def to_utc(local_timestamp):
+    """Convert a local 'YYYY-MM-DD HH:MM:SS' log time to the UTC format SQLite uses."""
+    local = datetime.datetime.strptime(local_timestamp, TIMESTAMP_FORMAT)
+    return local.astimezone(datetime.timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def iter_log_files(log_dir="logs"):
+    for root, dirs, files in os.walk(log_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith(".log"):
+                yield os.path.join(root, filename)
+
+
+def iter_log_entries(path):
+    """Yield ``(utc_timestamp, sender, message)`` for each entry in one log file."""
+    current = None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            match = ENTRY_PATTERN.match(line)
+            if match:
+                if current:
+                    yield _finish(current)
+                current = [match.group(1), match.group(2), [match.group(3)]]
+            elif current:
+                current[2].append(line)
+    if current:
+        yield _finish(current)
+
+
+def _finish(entry):
+    timestamp, sender, lines = entry
+    message = INNER_TIMESTAMP.sub('', "\n".join(lines).strip())
+    return to_utc(timestamp), sender, message
+
+
+def new_entries(conn, texts, timestamps):
+    """Return the indexes of the entries that are not stored in ``messages`` yet.
+
+    Each stored message, compared without its "[timestamp] " prefix, covers
+    one entry with the same text logged within ``DUPLICATE_WINDOW`` of it.
+    """
+    if not texts:
+        return []
+    times = [datetime.datetime.strptime(timestamp, TIMESTAMP_FORMAT) for timestamp in timestamps]
+    rows = conn.execute('SELECT text, timestamp FROM messages WHERE timestamp BETWEEN ? AND ?',
+                        ((min(times) - DUPLICATE_WINDOW).strftime(TIMESTAMP_FORMAT),
+                         (max(times) + DUPLICATE_WINDOW).strftime(TIMESTAMP_FORMAT))).fetchall()
+    stored = {}
+    for text, timestamp in rows:
+        stored.setdefault(INNER_TIMESTAMP.sub('', text.strip()), []).append(
+            datetime.datetime.strptime(timestamp[:19], TIMESTAMP_FORMAT))
+    keep = []
+    for i, (text, logged) in enumerate(zip(texts, times)):
+        candidates = stored.get(text, [])
+        match = next((stored for stored in candidates if abs(stored - logged) <= DUPLICATE_WINDOW), None)
+        if match is None:
+            keep.append(i)
+        else:
+            candidates.remove(match)
+    return keep
+
+
+def import_logs(vectordb, log_dir="logs", batch_size=256, skip_imported=True):
+    """Stream every chat log under ``log_dir`` into ``vectordb`` in batches.
+
+    Entries the chat window already stored are skipped (see ``new_entries``).
+    Files already recorded in the ``imported_logs`` table are skipped, so the
+    import can be re-run after new sessions. The newest file is only recorded
+    once its session closed, as it may still be written to.
+    Returns the number of messages added.
+    """
+    conn = vectordb.get_connection()
+    imported = {row[0] for row in conn.execute('SELECT path FROM imported_logs')} if skip_imported else set()
+    total = 0
+    texts, timestamps, finished_files = [], [], []
+
+    def flush():
+        nonlocal total
+        keep = new_entries(conn, texts, timestamps)
+        if keep:
+            vectordb.add_messages([texts[i] for i in keep], [timestamps[i] for i in keep])
+            total += len(keep)
+        if finished_files:
+            conn.executemany('INSERT OR REPLACE INTO imported_logs (path) VALUES (?)',
+                             [(path,) for path in finished_files])
+            conn.commit()
+        texts.clear()
+        timestamps.clear()
+        finished_files.clear()
+
+    paths = list(iter_log_files(log_dir))
+    for path in paths:
+        relative_path = os.path.relpath(path, log_dir)
+        if relative_path in imported:
+            continue
+        closed = False
+        for timestamp, sender, message in iter_log_entries(path):
+            closed = sender == "System" and message == CLOSED_MESSAGE
+            if sender in SKIPPED_SENDERS or not message:
+                continue
+            texts.append(message)
+            timestamps.append(timestamp)
+            if len(texts) >= batch_size:
+                flush()
+        if closed or path != paths[-1]:
+            finished_files.append(relative_path)
+        logger.info(f"Imported {path}")
+    flush()
+    logger.info(f"Imported {total} messages from {log_dir}")
+    return total
+
+
+if __name__ == '__main__':
+    from enhance_vectordb import EnhancedVectorDatabase
+
+    parser = argparse.ArgumentParser(description="Backfill the conversation vector store from chat logs")
+    parser.add_argument("--log-dir", default="logs")
+    parser.add_argument("--db", default="enhanced_chatbot.db")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--reimport", action="store_true", help="Import files even if already imported")
+    args = parser.parse_args()
+
+    db = EnhancedVectorDatabase(args.db)
+    count = import_logs(db, args.log_dir, args.batch_size, skip_imported=not args.reimport)
+    print(f"Imported {count} messages")
+    db.close()
@@ -0,0 +1,166 @@
+import datetime
+import logging
+import os
+import summary_pool
+import vector_codec
+import vector_search
+
+logger = logging.getLogger(__name__)
+
+DB_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Finest first; sessions are the rows of conversation_summaries
+LEVELS = ('session', 'day', 'week', 'month')
+# Periods summarised per build; a first build over a long history continues on later runs
+MAX_PERIODS = int(os.getenv('ROLLUP_MAX_PERIODS', 20))
+
+
+def period_bounds(level, time_text):
+    """Return the ``(start, end)`` UTC text bounds of the ``level`` period containing ``time_text``."""
+    moment = datetime.datetime.strptime(time_text[:19], DB_TIME_FORMAT)
+    start = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if level == 'day':
+        end = start + datetime.timedelta(days=1)
+    elif level == 'week':
+        start -= datetime.timedelta(days=start.weekday())
+        end = start + datetime.timedelta(days=7)
+    elif level == 'month':
+        start = start.replace(day=1)
+        end = (start + datetime.timedelta(days=32)).replace(day=1)
+    else:
+        raise ValueError(f"Unknown rollup level: {level}")
+    return start.strftime(DB_TIME_FORMAT), end.strftime(DB_TIME_FORMAT)
+
+
+def estimate_tokens(text):
+    return len(text.split()) * 4 // 3 + 1
+
+
+class MemoryRollup:
+    """Tree of summaries over time: session -> day -> week -> month.
+
+    Each closed day, week and month gets a summary of its children with its
+    own embedding in the summary_rollups table. A week belongs to the month
+    its Monday falls in. ``retrieve`` descends the tree from the roots,
+    following the ``beam`` most similar nodes at each level, so the number of
+    nodes it scores grows with the depth of the tree rather than the history.
+    """
+
+    def __init__(self, vectordb):
+        self.vectordb = vectordb
+
+    def _fetch(self, sql, params=()):
+        cursor = self.vectordb.get_connection().cursor()
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+    def _nodes(self, level, since=None, until=None):
+        """Nodes of ``level`` placed at or after ``since`` and before ``until``."""
+        if level == 'session':
+            sql = 'SELECT summary, embedding, start_time, end_time FROM conversation_summaries WHERE 1'
+            column, params = 'end_time', []
+        else:
+            sql = 'SELECT summary, embedding, period_start, period_end FROM summary_rollups WHERE level = ?'
+            column, params = 'period_start', [level]
+        if since is not None:
+            sql += f' AND {column} >= ?'
+            params.append(since)
+        if until is not None:
+            sql += f' AND {column} < ?'
+            params.append(until)
+        rows = self._fetch(sql + f' ORDER BY {column}', params)
+        return [{"level": level, "summary": row[0], "embedding": row[1], "start": row[2], "end": row[3]}
+                for row in rows]
+
+    @staticmethod
+    def _time_key(node):
+        # Sessions are placed by when they ended, rollups by where their period starts
+        return node["end"] if node["level"] == 'session' else node["start"]
+
+    def build(self, now=None, full=False, max_periods=MAX_PERIODS, should_stop=None):
+        """Summarise every closed period whose children changed; returns the number of nodes written.
+
+        Only periods from the latest existing node of each level onwards are
+        rescanned unless ``full`` is set. The build stops before summarising
+        another period once ``max_periods`` were written or ``should_stop()``
+        returns true; periods are taken oldest first and a level only after
+        the one below it is complete, so the next build picks up the rest.
+        """
+        now_text = (now or datetime.datetime.now(datetime.timezone.utc)).strftime(DB_TIME_FORMAT)
+        written = 0
+        for child_level, level in zip(LEVELS, LEVELS[1:]):
+            since = None
+            if not full:
+                since = self._fetch('SELECT MAX(period_start) FROM summary_rollups WHERE level = ?', (level,))[0][0]
+            groups = {}
+            for child in self._nodes(child_level, since=since):
+                groups.setdefault(period_bounds(level, self._time_key(child)), []).append(child)
+
+            for (period_start, period_end), children in sorted(groups.items()):
+                if period_end > now_text:
+                    continue  # still open
+                existing = self._fetch('SELECT source_count FROM summary_rollups WHERE level = ? AND period_start = ?',
+                                       (level, period_start))
+                if existing and existing[0][0] == len(children):
+                    continue
+                if written >= max_periods or (should_stop is not None and should_stop()):
+                    logger.info(f"Stopped rolling up after {written} periods; the rest follow on the next build")
+                    return written
+                texts = [child["summary"] for child in children]
+                summary = self.vectordb.summary_pool.submit(summary_pool.summarize_conversation, texts).result()
+
+                def insert(conn, model, blobs):
+                    conn.execute('INSERT OR REPLACE INTO summary_rollups (level, period_start, period_end, summary, '
+                                 'embedding, embedding_model, source_count) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                 (level, period_start, period_end, summary, blobs[0], model, len(children)))
+
+                self.vectordb.insert_embedded([summary], insert)
+                written += 1
+                logger.info(f"Rolled up {len(children)} {child_level} summaries into {level} {period_start}")
+        return written
+
+    def _roots(self):
+        """Top-level nodes plus any lower-level nodes newer than the last node above them."""
+        roots = []
+        covered_until = None
+        for level in reversed(LEVELS):
+            nodes = self._nodes(level, since=covered_until)
+            roots.extend(nodes)
+            if nodes and level != 'session':
+                covered_until = max(covered_until or "", max(node["end"] for node in nodes))
+        return roots
+
+    def _children(self, node):
+        level = LEVELS[LEVELS.index(node["level"]) - 1]
+        return self._nodes(level, since=node["start"], until=node["end"])
+
+    def retrieve(self, query, token_budget=1024, beam=2):
+        """Most relevant summaries for ``query`` that fit in ``token_budget``, oldest first.
+
+        Returns dicts with level, start, end, summary and similarity. Finer
+        nodes are preferred over coarser ones when both fit.
+        """
+        query_vector = vector_search.normalize(self.vectordb.embed_query(query))
+        chosen = []
+        frontier = self._roots()
+        while frontier:
+            vectors = vector_search.normalize_rows(
+                vector_codec.decode_many([node["embedding"] for node in frontier]))
+            scores = vectors @ query_vector
+            best = vector_search.top_k(scores, beam)
+            next_frontier = []
+            for i in best:
+                node = frontier[i]
+                node["similarity"] = float(scores[i])
+                chosen.append(node)
+                if node["level"] != 'session':
+                    next_frontier.extend(self._children(node))
+            frontier = next_frontier
+
+        selected, used = [], 0
+        for node in sorted(chosen, key=lambda n: (LEVELS.index(n["level"]), -n["similarity"])):
+            cost = estimate_tokens(node["summary"])
+            if used + cost <= token_budget:
+                selected.append(node)
+                used += cost
+        selected.sort(key=lambda n: n["start"])
+        return [{key: node[key] for key in ("level", "start", "end", "summary", "similarity")} for node in selected]
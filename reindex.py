@@ -0,0 +1,243 @@
+import argparse
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import embedding_service
+import entity_journal
+import entity_storage
+import entity_vector_store
+import vector_codec
+from enhance_vectordb import EMBEDDED_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+STAGING_FOLDER = "staging"
+# Stop catching up in the background once a pass finds fewer new rows than this
+CATCH_UP_ROWS = 256
+MAX_PASSES = 5
+
+
+def _init_worker(model_name, threads):
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    embedding_service.get_model(model_name)
+
+
+def _encode_batch(model_name, keys, texts):
+    return keys, embedding_service.encode(texts, use_cache=False, model_name=model_name)
+
+
+def create_pool(model_name, processes=None):
+    """Process pool whose workers each load ``model_name`` once and split the CPU threads between them."""
+    cpus = os.cpu_count() or 1
+    processes = processes or max(1, cpus // 2)
+    return ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                               initargs=(model_name, max(1, cpus // processes)))
+
+
+def encode_in_pool(executor, model_name, batches, handle, in_flight=8):
+    """Encode ``(keys, texts)`` batches in ``executor``, calling ``handle(keys, vectors)`` as each finishes.
+
+    At most ``in_flight`` batches are outstanding, so memory stays bounded
+    however large the input is. Returns the number of texts encoded.
+    """
+    pending = set()
+    count = 0
+
+    def collect(futures):
+        nonlocal count
+        for future in futures:
+            keys, vectors = future.result()
+            handle(keys, vectors)
+            count += len(keys)
+
+    for keys, texts in batches:
+        pending.add(executor.submit(_encode_batch, model_name, keys, texts))
+        if len(pending) >= in_flight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+    collect(wait(pending).done)
+    return count
+
+
+def _unstaged_batches(conn, table, batch_size):
+    """Yield ``(ids, texts)`` for rows of ``table`` without a staged embedding, oldest first."""
+    column = EMBEDDED_COLUMNS[table]
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            f'SELECT id, {column} FROM {table} t WHERE id > ? AND NOT EXISTS '
+            f'(SELECT 1 FROM embedding_staging s WHERE s.source = ? AND s.id = t.id) ORDER BY id LIMIT ?',
+            (last_id, table, batch_size)).fetchall()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield [row[0] for row in rows], [row[1] for row in rows]
+
+
+def reindex_database(vectordb, model_name, executor, batch_size=256, in_flight=8):
+    """Re-encode every embedding in ``vectordb`` with ``model_name`` and switch to it.
+
+    New embeddings go to the embedding_staging table while searches keep
+    using the current ones. Rows added meanwhile are picked up by further
+    passes, and the last few are encoded inside the write transaction that
+    copies the staged embeddings over and changes the active model. An
+    interrupted run resumes from what is already staged for the same model.
+    Returns the number of rows encoded.
+    """
+    conn = vectordb.get_connection()
+    row = conn.execute("SELECT value FROM embedding_meta WHERE key = 'staging_model'").fetchone()
+    if row is None or row[0] != model_name:
+        conn.execute('DELETE FROM embedding_staging')
+        conn.execute("INSERT OR REPLACE INTO embedding_meta (key, value) VALUES ('staging_model', ?)", (model_name,))
+        conn.commit()
+
+    def stage(table, ids, vectors):
+        conn.executemany('INSERT OR REPLACE INTO embedding_staging (source, id, embedding) VALUES (?, ?, ?)',
+                         [(table, row_id, vector_codec.encode(vector, vectordb.storage))
+                          for row_id, vector in zip(ids, vectors)])
+
+    def stage_and_commit(table):
+        def handle(ids, vectors):
+            stage(table, ids, vectors)
+            conn.commit()
+        return handle
+
+    total = 0
+    for attempt in range(MAX_PASSES):
+        encoded = sum(encode_in_pool(executor, model_name, _unstaged_batches(conn, table, batch_size),
+                                     stage_and_commit(table), in_flight)
+                      for table in EMBEDDED_COLUMNS)
+        total += encoded
+        logger.info(f"Staged {encoded} embeddings in pass {attempt + 1}")
+        if encoded < CATCH_UP_ROWS:
+            break
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for table in EMBEDDED_COLUMNS:
+            for ids, texts in _unstaged_batches(conn, table, batch_size):
+                stage(table, ids, embedding_service.encode(texts, use_cache=False, model_name=model_name))
+                total += len(ids)
+            conn.execute(f'UPDATE {table} SET embedding = s.embedding, embedding_model = ? FROM embedding_staging s '
+                         f'WHERE s.source = ? AND s.id = {table}.id', (model_name, table))
+        conn.execute("UPDATE embedding_meta SET value = ? WHERE key = 'model'", (model_name,))
+        conn.execute("DELETE FROM embedding_meta WHERE key = 'staging_model'")
+        conn.execute('DELETE FROM embedding_staging')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    vectordb.current_embedding_model()
+
+    # A writer that encoded just before the swap may have inserted with the old model
+    for table, column in EMBEDDED_COLUMNS.items():
+        stale = conn.execute(f'SELECT id, {column} FROM {table} WHERE embedding_model IS NOT ?',
+                             (model_name,)).fetchall()
+        if stale:
+            vectors = embedding_service.encode([text for _, text in stale], use_cache=False, model_name=model_name)
+            conn.executemany(f'UPDATE {table} SET embedding = ?, embedding_model = ? WHERE id = ?',
+                             [(vector_codec.encode(vector, vectordb.storage), model_name, row_id)
+                              for (row_id, _), vector in zip(stale, vectors)])
+            conn.commit()
+            if table in vectordb.matrices:
+                vectordb.invalidate_matrix(table)
+            total += len(stale)
+    logger.info(f"Switched {vectordb.db_path} to {model_name}")
+    return total
+
+
+def reindex_entities(db_folder, model_name, executor, batch_size=256, in_flight=8):
+    """Re-encode every entity in ``db_folder`` into a staging store and swap it in.
+
+    The live store keeps answering searches until the swap. The catch-up
+    and the swap hold the store's lock file, which every process takes to
+    write entity vectors, so no write can land in the old files meanwhile;
+    a writer that encoded with the old model re-encodes after the swap.
+    Entities modified while the staging store was built, including changes
+    still in another process's entity journal, are encoded again just
+    before the files are replaced.
+    Returns the number of field chunks encoded.
+    """
+    store = entity_vector_store.get_store(db_folder)
+    storage = entity_storage.get_storage(db_folder)
+    staging_folder = os.path.join(db_folder, STAGING_FOLDER)
+    shutil.rmtree(staging_folder, ignore_errors=True)
+    staging = entity_vector_store.EntityVectorStore(staging_folder, ann_threshold=None, model=model_name)
+    started = time.time()
+
+    def handle(keys, vectors):
+        staging.set_many(zip(keys, vectors))
+
+    def field_texts(entities):
+        texts = {}
+        for name, data in entities.items():
+            texts.update(entity_storage.field_texts(name, data))
+        return texts
+
+    def batches():
+        names = storage.names()
+        for start in range(0, len(names), batch_size):
+            texts = field_texts(storage.read_many(names[start:start + batch_size]))
+            if texts:
+                yield list(texts), list(texts.values())
+
+    total = encode_in_pool(executor, model_name, batches(), handle, in_flight)
+
+    with store.write_lock():
+        # Read the journal first: an entity compacted after this shows up in modified_since
+        journaled = entity_journal.read_journal(os.path.join(db_folder, entity_journal.JOURNAL_FILE), storage.read)
+        names = set(storage.names())
+        names.difference_update(name for name, data in journaled.items() if data is None)
+        names.update(name for name, data in journaled.items() if data is not None)
+        changed = (set(storage.modified_since(started)) | set(journaled)
+                   | {name for name in names if not staging.group(name)}) & names
+        for name in changed:
+            staging.delete_group(name)
+        entities = storage.read_many(sorted(changed))
+        entities.update((name, journaled[name]) for name in changed if journaled.get(name) is not None)
+        texts = field_texts(entities)
+        if texts:
+            handle(list(texts),
+                   embedding_service.encode(list(texts.values()), use_cache=False, model_name=model_name))
+            total += len(texts)
+        for name in set(staging.group_names()) - names:
+            staging.delete_group(name)
+        staging.compact_index()
+
+        os.replace(staging.matrix_path, store.matrix_path)
+        os.replace(staging.index_path, store.index_path)
+        for path in (store.ann.path, store.ann.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        store.load()
+    shutil.rmtree(staging_folder, ignore_errors=True)
+    logger.info(f"Switched {db_folder} entity vectors to {model_name}")
+    return total
+
+
+if __name__ == '__main__':
+    from enhance_vectordb import EnhancedVectorDatabase
+
+    parser = argparse.ArgumentParser(description="Re-encode all stored embeddings with another model")
+    parser.add_argument("model", help="SentenceTransformer model name, e.g. all-mpnet-base-v2")
+    parser.add_argument("--db", default="enhanced_chatbot.db")
+    parser.add_argument("--entity-db", default="entity_db")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--skip-entities", action="store_true")
+    args = parser.parse_args()
+
+    db = EnhancedVectorDatabase(args.db)
+    with create_pool(args.model, args.processes) as pool:
+        count = reindex_database(db, args.model, pool, args.batch_size)
+        print(f"Re-encoded {count} messages and summaries with {args.model}")
+        if not args.skip_entities:
+            count = reindex_entities(args.entity_db, args.model, pool, args.batch_size)
+            print(f"Re-encoded {count} entity field chunks with {args.model}")
+    db.close()
@@ -0,0 +1,233 @@
+import argparse
+import json
+import logging
+import platform
+import random
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import summary_pool
+from log_import import SKIPPED_SENDERS, iter_log_entries, iter_log_files
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is reported as unavailable
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = (10, 50, 200, 1000)
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+# Synthetic conversations mix small talk with one key fact per topic; the
+# facts are the reference summary.
+TOPICS = {
+    "travel": "The user is flying to Lisbon on the twelfth of March for a conference",
+    "pets": "The user adopted a grey cat named Pixel from the shelter",
+    "work": "The user is migrating the billing service from MySQL to PostgreSQL",
+    "health": "The user started running three mornings a week to train for a half marathon",
+    "cooking": "The user is allergic to peanuts and avoids satay dishes",
+    "music": "The user is learning the cello and practises Bach suites on weekends",
+    "family": "The user's sister is getting married in Porto in September",
+    "finance": "The user wants to save for a deposit on a flat within two years",
+}
+FILLER = [
+    "That sounds interesting, tell me more about it.",
+    "I see, how do you feel about that so far?",
+    "Thanks for sharing that with me.",
+    "Sure, I can help you think that through.",
+    "Let me know if there is anything else on your mind.",
+    "Honestly it has been a long week.",
+    "I was thinking about it again this morning.",
+    "Yes, that makes sense to me.",
+]
+
+
+def synthetic_corpus(size, seed=0):
+    """Return ``(messages, reference)`` for a conversation of ``size`` messages."""
+    rng = random.Random(seed + size)
+    topics = rng.sample(sorted(TOPICS), min(len(TOPICS), max(1, size // 8)))
+    fact_positions = dict(zip(rng.sample(range(size), len(topics)), topics))
+    messages = []
+    for i in range(size):
+        if i in fact_positions:
+            messages.append(TOPICS[fact_positions[i]] + ".")
+        else:
+            messages.append(rng.choice(FILLER))
+    reference = ". ".join(TOPICS[topic] for _, topic in sorted(fact_positions.items())) + "."
+    return messages, reference
+
+
+def recorded_corpus(log_dir, size):
+    """Return ``(messages, None)`` with the first ``size`` messages of the chat logs in ``log_dir``."""
+    messages = []
+    for path in iter_log_files(log_dir):
+        for _, sender, message in iter_log_entries(path):
+            if sender in SKIPPED_SENDERS or not message:
+                continue
+            messages.append(message)
+            if len(messages) >= size:
+                return messages, None
+    return messages, None
+
+
+def _tokens(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def _f1(overlap, candidate_total, reference_total):
+    precision = overlap / candidate_total if candidate_total else 0.0
+    recall = overlap / reference_total if reference_total else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+
+def _ngrams(tokens, n):
+    return Counter(tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+
+
+def _lcs_length(a, b):
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            current.append(previous[j] + 1 if x == y else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+def rouge(candidate, reference):
+    """ROUGE-1, ROUGE-2 and ROUGE-L precision/recall/F1 over lower-cased word tokens."""
+    cand, ref = _tokens(candidate), _tokens(reference)
+    scores = {}
+    for n in (1, 2):
+        cand_ngrams, ref_ngrams = _ngrams(cand, n), _ngrams(ref, n)
+        overlap = sum((cand_ngrams & ref_ngrams).values())
+        scores[f"rouge{n}"] = _f1(overlap, sum(cand_ngrams.values()), sum(ref_ngrams.values()))
+    scores["rougeL"] = _f1(_lcs_length(cand, ref), len(cand), len(ref))
+    return scores
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process, or None where ``resource`` is unavailable."""
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def run_case(method, messages, reference, num_sentences, repeats):
+    """Time one method on one corpus; runs in a fresh worker process so memory figures are per case.
+
+    The first call is reported separately as the cold start since it
+    includes model loading for BART. Timed calls run without tracemalloc,
+    which slows pure-Python methods far more than the others; the Python
+    peak comes from one more, untimed, traced call.
+    """
+    started = time.perf_counter()
+    try:
+        summary = summary_pool.summarize(method, messages, num_sentences)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    cold = time.perf_counter() - started
+    warm = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        summary_pool.summarize(method, messages, num_sentences)
+        warm.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        summary_pool.summarize(method, messages, num_sentences)
+        _, peak_python = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    summary = summary or ""
+    source = " ".join(messages)
+    return {
+        "cold_seconds": cold,
+        "warm_seconds": statistics.median(warm) if warm else None,
+        "peak_python_bytes": peak_python,
+        "peak_rss_bytes": peak_rss_bytes(),
+        "summary_words": len(summary.split()),
+        "compression": len(summary) / len(source) if source else None,
+        # Recorded logs have no reference summary, so they are scored for coverage of the source
+        "rouge": rouge(summary, reference if reference is not None else source),
+        "reference": "gold" if reference is not None else "source",
+        "summary": summary,
+    }
+
+
+def run_benchmark(methods, sizes, log_dir=None, num_sentences=5, repeats=3, seed=0):
+    """Run every method over every corpus; returns a list of result dicts."""
+    corpora = []
+    for size in sizes:
+        corpora.append(("synthetic", size) + synthetic_corpus(size, seed))
+        if log_dir:
+            messages, reference = recorded_corpus(log_dir, size)
+            if len(messages) < size:
+                logger.warning(f"Only {len(messages)} messages in {log_dir}; skipping recorded size {size}")
+            else:
+                corpora.append(("recorded", size, messages, reference))
+
+    results = []
+    for corpus, size, messages, reference in corpora:
+        for method in methods:
+            # A new process per case keeps one method's models and peak RSS out of the next one's numbers
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(run_case, method, messages, reference, num_sentences, repeats).result()
+            result.update({"method": method, "corpus": corpus, "messages": size})
+            results.append(result)
+            if "error" in result:
+                logger.warning(f"{method} on {corpus}/{size}: {result['error']}")
+            else:
+                logger.info(f"{method} on {corpus}/{size}: {result['cold_seconds']:.2f}s cold, "
+                            f"ROUGE-1 F1 {result['rouge']['rouge1']['f1']:.3f}")
+    return results
+
+
+def format_table(results):
+    lines = [f"{'method':<11} {'corpus':<10} {'msgs':>5} {'cold s':>8} {'warm s':>8} {'peak MB':>8} "
+             f"{'R1 F1':>6} {'R2 F1':>6} {'RL F1':>6}"]
+    for r in results:
+        prefix = f"{r['method']:<11} {r['corpus']:<10} {r['messages']:>5}"
+        if "error" in r:
+            lines.append(f"{prefix} {r['error']}")
+            continue
+        warm = f"{r['warm_seconds']:.3f}" if r["warm_seconds"] is not None else "-"
+        peak = f"{r['peak_rss_bytes'] / 2 ** 20:.0f}" if r["peak_rss_bytes"] is not None else "-"
+        lines.append(f"{prefix} {r['cold_seconds']:>8.3f} {warm:>8} {peak:>8} "
+                     f"{r['rouge']['rouge1']['f1']:>6.3f} {r['rouge']['rouge2']['f1']:>6.3f} "
+                     f"{r['rouge']['rougeL']['f1']:>6.3f}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare summarisation methods on speed, memory and ROUGE")
+    parser.add_argument("--methods", nargs="+", default=list(summary_pool.SUMMARY_METHODS),
+                        choices=list(summary_pool.SUMMARY_METHODS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES))
+    parser.add_argument("--log-dir", help="Also benchmark on messages from these chat logs")
+    parser.add_argument("--num-sentences", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=3, help="Warm runs per case after the cold run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="summary_benchmark.json")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    results = run_benchmark(args.methods, args.sizes, args.log_dir, args.num_sentences, args.repeats, args.seed)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "settings": vars(args),
+            "results": results,
+        }, f, indent=2)
+    print(format_table(results))
+    print(f"Results written to {args.output}")
@@ -0,0 +1,125 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.cluster import KMeans
+from summa import summarizer
+from bart_summarizer import LazyBartSummarizer
+
+logger = logging.getLogger(__name__)
+
+# Per-process summariser; in the pool's worker process it keeps BART resident
+# between jobs until it has been idle for the configured time.
+_bart = None
+_bart_idle_seconds = 300
+
+
+def _init_worker(idle_seconds):
+    global _bart_idle_seconds
+    _bart_idle_seconds = idle_seconds
+
+
+def get_bart():
+    global _bart
+    if _bart is None:
+        _bart = LazyBartSummarizer(idle_seconds=_bart_idle_seconds)
+    return _bart
+
+
+def summarize_tfidf(messages, num_sentences=3):
+    text = " ".join(messages)
+    sentences = text.split('. ')
+    vectorizer = TfidfVectorizer().fit_transform(sentences)
+    vectors = vectorizer.toarray()
+    cosine_matrix = cosine_similarity(vectors)
+    scores = cosine_matrix.sum(axis=1)
+    ranked_sentences = [sentences[i] for i in np.argsort(scores, axis=0)[::-1]]
+    summary = ". ".join(ranked_sentences[:num_sentences])
+    return summary
+
+
+def summarize_text_rank(messages, num_sentences=3):
+    text = " ".join(messages)
+    summary = summarizer.summarize(text, words=50)
+    return summary
+
+
+def summarize_bart(messages, num_sentences=3):
+    text = " ".join(messages)
+    return get_bart().summarize(text, max_length=1024)
+
+
+def summarize_clustering(messages, num_sentences=5):
+    text = " ".join(messages)
+    sentences = text.split('. ')
+    vectorizer = TfidfVectorizer().fit_transform(sentences)
+    vectors = vectorizer.toarray()
+    kmeans = KMeans(n_clusters=num_sentences, random_state=0).fit(vectors)
+    cluster_centers = kmeans.cluster_centers_
+    closest = np.argsort(cosine_similarity(cluster_centers, vectors), axis=1)
+    summary = ". ".join([sentences[i] for i in closest[:, -1]])
+    return summary
+
+
+SUMMARY_METHODS = {
+    "tfidf": summarize_tfidf,
+    "textrank": summarize_text_rank,
+    "bart": summarize_bart,
+    "clustering": summarize_clustering,
+}
+
+
+def summarize(method, messages, num_sentences=5):
+    if method not in SUMMARY_METHODS:
+        raise ValueError("Unsupported summarization method")
+    return SUMMARY_METHODS[method](messages, num_sentences)
+
+
+def summarize_conversation(texts, max_length=150):
+    """Map-reduce BART summary of a conversation given oldest message first."""
+    return get_bart().summarize_long(texts, max_length=max_length)
+
+
+class SummaryPool:
+    """Runs summarisation jobs in a separate worker process.
+
+    The process is started on the first job and keeps its models resident
+    between jobs, so BART generation and KMeans do not compete with the GUI
+    and chat threads for the GIL. With ``processes=False`` jobs run on a
+    background thread in this process instead.
+    """
+
+    def __init__(self, idle_seconds=300, processes=True):
+        self.idle_seconds = idle_seconds
+        self.processes = processes
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def _create_executor(self):
+        if self.processes:
+            # Spawn rather than fork: the pool starts inside a running, multithreaded GUI process
+            return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker, initargs=(self.idle_seconds,))
+        _init_worker(self.idle_seconds)
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix="SummaryPool")
+
+    def submit(self, fn, *args, **kwargs):
+        with self.lock:
+            if self.executor is None:
+                self.executor = self._create_executor()
+            try:
+                return self.executor.submit(fn, *args, **kwargs)
+            except BrokenProcessPool:
+                logger.warning("Summary worker process died, starting a new one")
+                self.executor = self._create_executor()
+                return self.executor.submit(fn, *args, **kwargs)
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
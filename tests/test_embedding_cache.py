@@ -0,0 +1,14 @@
+import time
+import numpy as np
+from embedding_cache import EmbeddingCache
+
+
+def test_memory_hits_keep_keys_from_being_trimmed(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.db"), max_entries=10, memory_entries=100)
+    cache.put_many([("hot", np.ones(2))])
+    for i in range(10):
+        time.sleep(0.002)
+        assert "hot" in cache.get_many(["hot"])
+        cache.put_many([(f"key{i}", np.ones(2))])
+    assert cache.conn.execute("SELECT 1 FROM embedding_cache WHERE key = 'hot'").fetchone()
+    cache.close()
@@ -0,0 +1,134 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import pytest
+import entity_journal
+import entity_storage
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def engine(request):
+    return request.param
+
+
+def open_journal(folder, engine, compact_interval=3600):
+    storage = entity_storage.STORAGE_ENGINES[engine](str(folder))
+    return entity_journal.EntityJournal(storage, compact_interval=compact_interval)
+
+
+def journal_lines(folder):
+    with open(os.path.join(folder, entity_journal.JOURNAL_FILE), encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def test_mutations_are_on_disk_when_they_return(tmp_path, engine):
+    journal = open_journal(tmp_path, engine)
+    journal.write("Tony", {"city": "Lisbon"})
+    assert journal.set_fields("Tony", {"job": "dev"}) == {"city": "Lisbon", "job": "dev"}
+    assert journal.delete("Tony")
+    assert not journal.delete("Nobody")
+    assert journal_lines(tmp_path) == [
+        {"name": "Tony", "data": {"city": "Lisbon"}},
+        {"name": "Tony", "fields": {"job": "dev"}},
+        {"name": "Tony", "data": None},
+    ]
+    journal.close()
+
+
+def test_replay_restores_uncompacted_changes(tmp_path, engine):
+    journal = open_journal(tmp_path, engine)
+    journal.write("Tony", {"city": "Lisbon"})
+    journal.set_fields("Tony", {"job": "dev"})
+    journal.write("Gone", {"x": 1})
+    journal.delete("Gone")
+    # Abandon it without compacting, as a crash would
+    journal.running = False
+
+    replayed = open_journal(tmp_path, engine)
+    assert replayed.read("Tony") == {"city": "Lisbon", "job": "dev"}
+    assert replayed.read("Gone") is None
+    assert replayed.names() == ["Tony"]
+    assert replayed.storage.read("Tony") is None
+    replayed.close()
+
+
+def test_replay_skips_a_torn_last_line(tmp_path, engine):
+    journal = open_journal(tmp_path, engine)
+    journal.write("Tony", {"city": "Lisbon"})
+    journal.running = False
+    with open(os.path.join(tmp_path, entity_journal.JOURNAL_FILE), 'a', encoding='utf-8') as f:
+        f.write('{"name": "Tony", "fie')
+
+    replayed = open_journal(tmp_path, engine)
+    assert replayed.read("Tony") == {"city": "Lisbon"}
+    replayed.close()
+
+
+def test_compaction_writes_the_engine_and_empties_the_journal(tmp_path, engine):
+    journal = open_journal(tmp_path, engine)
+    journal.storage.write("Old", {"x": 1})
+    journal.write("Tony", {"city": "Lisbon"})
+    journal.set_fields("Tony", {"job": "dev"})
+    journal.delete("Old")
+    journal.compact()
+
+    assert journal.overlay == {}
+    assert journal_lines(tmp_path) == []
+    assert journal.storage.read("Tony") == {"city": "Lisbon", "job": "dev"}
+    assert journal.storage.read("Old") is None
+
+    journal.set_fields("Tony", {"age": 30})
+    assert journal_lines(tmp_path) == [{"name": "Tony", "fields": {"age": 30}}]
+    journal.close()
+    assert entity_storage.STORAGE_ENGINES[engine](str(tmp_path)).read("Tony") == \
+        {"city": "Lisbon", "job": "dev", "age": 30}
+
+
+def test_concurrent_writers_share_fsyncs(tmp_path, monkeypatch):
+    journal = open_journal(tmp_path, "json")
+    fsyncs = []
+    real_fsync = os.fsync
+
+    def slow_fsync(fd):
+        fsyncs.append(fd)
+        time.sleep(0.005)
+        real_fsync(fd)
+
+    monkeypatch.setattr(entity_journal.os, "fsync", slow_fsync)
+
+    def writer(i):
+        for j in range(20):
+            journal.set_fields("Websites", {f"url{i}-{j}": j})
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(journal_lines(tmp_path)) == 160
+    assert len(journal.read("Websites")) == 160
+    # Writers waiting behind a slow fsync are committed together by the next one
+    assert len(fsyncs) < 160 / 2
+    journal.close()
+
+
+def test_field_written_before_a_crash_survives(tmp_path, engine):
+    script = (
+        "import os, sys\n"
+        f"sys.path.insert(0, {REPO!r})\n"
+        "import entity_storage\n"
+        f"storage = entity_storage.get_storage({str(tmp_path)!r}, {engine!r})\n"
+        "storage.set_fields('Tony', {'job': 'dev'})\n"
+        "os._exit(0)\n"
+    )
+    subprocess.run([sys.executable, "-c", script], check=True, env=dict(os.environ, ENTITY_JOURNAL="1"))
+
+    journal = open_journal(tmp_path, engine)
+    assert journal.read("Tony") == {"job": "dev"}
+    journal.close()
@@ -0,0 +1,43 @@
+import json
+import os
+import entity_storage
+
+
+def write_json_entity(folder, name, data):
+    with open(os.path.join(folder, f"{name}.json"), 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def test_sqlite_imports_json_files_once(tmp_path):
+    write_json_entity(tmp_path, "Tony", {"city": "Lisbon"})
+    write_json_entity(tmp_path, "Ana", {"city": "Porto"})
+    storage = entity_storage.SqliteEntityStorage(str(tmp_path))
+    assert storage.names() == ["Ana", "Tony"]
+
+    # The JSON files stay in place, so deleted entities must not come back on the next open
+    storage.delete("Tony")
+    storage.delete("Ana")
+    storage = entity_storage.SqliteEntityStorage(str(tmp_path))
+    assert storage.names() == []
+
+
+def test_sqlite_marks_databases_imported_before_the_marker(tmp_path):
+    storage = entity_storage.SqliteEntityStorage(str(tmp_path))
+    storage.write("Ana", {"city": "Porto"})
+    conn = storage.get_connection()
+    conn.execute("DELETE FROM entity_meta")
+    conn.commit()
+
+    write_json_entity(tmp_path, "Tony", {"city": "Lisbon"})
+    storage = entity_storage.SqliteEntityStorage(str(tmp_path))
+    assert storage.names() == ["Ana"]
+    storage.delete("Ana")
+    storage = entity_storage.SqliteEntityStorage(str(tmp_path))
+    assert storage.names() == []
+
+
+def test_legacy_vector_file_is_not_an_entity(tmp_path):
+    write_json_entity(tmp_path, "entity_vectors", {"Old": [0.1, 0.2]})
+    write_json_entity(tmp_path, "Tony", {"city": "Lisbon"})
+    assert entity_storage.JsonEntityStorage(str(tmp_path)).names() == ["Tony"]
+    assert entity_storage.SqliteEntityStorage(str(tmp_path)).names() == ["Tony"]
@@ -0,0 +1,47 @@
+import numpy as np
+import entity_vector_store
+
+
+def vector(value):
+    return np.full(4, value, dtype=np.float32)
+
+
+def test_stores_sharing_a_folder_see_each_others_writes(tmp_path):
+    a = entity_vector_store.EntityVectorStore(str(tmp_path))
+    b = entity_vector_store.EntityVectorStore(str(tmp_path))
+    a.set("A", vector(1))
+    b.set("B", vector(2))
+    assert b.get("A") is not None
+    a.delete("A")
+    b.set("C", vector(3))
+    a.set("D", vector(4))
+
+    reopened = entity_vector_store.EntityVectorStore(str(tmp_path))
+    assert sorted(reopened.rows) == ["B", "C", "D"]
+    assert len(set(reopened.rows.values())) == 3
+    for name, value in (("B", 2), ("C", 3), ("D", 4)):
+        assert np.array_equal(reopened.get(name), vector(value))
+        assert np.array_equal(a.get(name), vector(value))
+    assert a.search(vector(3), top_k=3)[0][0] in {"B", "C", "D"}
+    assert sorted(a.names()) == sorted(b.names()) == ["B", "C", "D"]
+
+
+def test_search_sees_rows_added_by_another_store(tmp_path):
+    a = entity_vector_store.EntityVectorStore(str(tmp_path))
+    b = entity_vector_store.EntityVectorStore(str(tmp_path))
+    a.set("A", [1, 0, 0, 0])
+    assert [name for name, _ in a.search(np.array([1, 0, 0, 0]), top_k=5)] == ["A"]
+    b.set("B", [0, 1, 0, 0])
+    assert a.search(np.array([0, 1, 0, 0]), top_k=1)[0][0] == "B"
+    b.delete("A")
+    assert [name for name, _ in a.search(np.array([1, 0, 0, 0]), top_k=5)] == ["B"]
+
+
+def test_torn_index_line_does_not_swallow_the_next_record(tmp_path):
+    a = entity_vector_store.EntityVectorStore(str(tmp_path))
+    a.set("A", vector(1))
+    with open(a.index_path, 'a', encoding='utf-8') as f:
+        f.write('{"name": "X", "ro')
+    b = entity_vector_store.EntityVectorStore(str(tmp_path))
+    b.set("B", vector(2))
+    assert sorted(entity_vector_store.EntityVectorStore(str(tmp_path)).rows) == ["A", "B"]
@@ -0,0 +1,65 @@
+import datetime
+import os
+import sqlite3
+import log_import
+
+
+class MessageStore:
+    """Just the parts of EnhancedVectorDatabase that import_logs uses."""
+
+    def __init__(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute('CREATE TABLE messages (id INTEGER PRIMARY KEY, text TEXT NOT NULL, '
+                          'timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)')
+        self.conn.execute('CREATE TABLE imported_logs (path TEXT PRIMARY KEY)')
+
+    def get_connection(self):
+        return self.conn
+
+    def add_messages(self, texts, timestamps):
+        self.conn.executemany('INSERT INTO messages (text, timestamp) VALUES (?, ?)', zip(texts, timestamps))
+        self.conn.commit()
+
+    def texts(self):
+        return [row[0] for row in self.conn.execute('SELECT text FROM messages ORDER BY id')]
+
+    def imported(self):
+        return [row[0] for row in self.conn.execute('SELECT path FROM imported_logs ORDER BY path')]
+
+
+def write_log(folder, name, entries):
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, name), 'a', encoding='utf-8') as f:
+        for local_time, sender, message in entries:
+            f.write(f"\n[{local_time}] {sender}: {message}\n")
+
+
+def test_skips_turns_the_chat_window_already_stored(tmp_path):
+    store = MessageStore()
+    # Stored by ChatWorker after the reply: the user's text keeps its prefix, the time is the insert time
+    logged = datetime.datetime(2026, 3, 1, 10, 0, 0)
+    utc = log_import.to_utc(logged.strftime(log_import.TIMESTAMP_FORMAT))
+    inserted = (datetime.datetime.strptime(utc, log_import.TIMESTAMP_FORMAT)
+                + datetime.timedelta(seconds=20)).strftime(log_import.TIMESTAMP_FORMAT)
+    store.add_messages(["[2026-03-01 10:00:00] hello", "hi there"], [inserted, inserted])
+    write_log(tmp_path / "2026-03-01", "10-00-00.log", [
+        ("2026-03-01 10:00:00", "You", "[2026-03-01 10:00:00] hello"),
+        ("2026-03-01 10:00:05", "Gemini", "[2026-03-01 10:00:05] hi there"),
+        ("2026-03-01 10:01:00", "You", "[2026-03-01 10:01:00] hello"),
+    ])
+    assert log_import.import_logs(store, str(tmp_path)) == 1
+    assert store.texts() == ["[2026-03-01 10:00:00] hello", "hi there", "hello"]
+
+
+def test_newest_log_is_imported_again_until_closed(tmp_path):
+    store = MessageStore()
+    write_log(tmp_path / "2026-03-01", "09-00-00.log", [("2026-03-01 09:00:00", "You", "first session")])
+    write_log(tmp_path / "2026-03-01", "10-00-00.log", [("2026-03-01 10:00:00", "You", "one")])
+    assert log_import.import_logs(store, str(tmp_path)) == 2
+    assert store.imported() == [os.path.join("2026-03-01", "09-00-00.log")]
+
+    write_log(tmp_path / "2026-03-01", "10-00-00.log", [("2026-03-01 10:05:00", "You", "two"),
+                                                        ("2026-03-01 10:06:00", "System", "Application closed")])
+    assert log_import.import_logs(store, str(tmp_path)) == 1
+    assert store.texts() == ["first session", "one", "two"]
+    assert len(store.imported()) == 2
@@ -0,0 +1,66 @@
+import datetime
+import sqlite3
+from concurrent.futures import Future
+import numpy as np
+import pytest
+
+memory_rollup = pytest.importorskip("memory_rollup")
+
+
+class SummaryPool:
+    def submit(self, fn, texts):
+        future = Future()
+        future.set_result(" ".join(texts))
+        return future
+
+
+class RollupStore:
+    """Just the parts of EnhancedVectorDatabase that MemoryRollup.build uses."""
+
+    summary_pool = SummaryPool()
+
+    def __init__(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute('CREATE TABLE conversation_summaries (summary TEXT, embedding BLOB, '
+                          'start_time DATETIME, end_time DATETIME)')
+        self.conn.execute('CREATE TABLE summary_rollups (level TEXT, period_start DATETIME, period_end DATETIME, '
+                          'summary TEXT, embedding BLOB, embedding_model TEXT, source_count INTEGER, '
+                          'UNIQUE (level, period_start))')
+
+    def get_connection(self):
+        return self.conn
+
+    def insert_embedded(self, texts, insert):
+        insert(self.conn, 'test-model', [np.ones(4, dtype=np.float32).tobytes() for _ in texts])
+        self.conn.commit()
+
+    def rollup_counts(self):
+        return dict(self.conn.execute('SELECT level, COUNT(*) FROM summary_rollups GROUP BY level'))
+
+
+@pytest.fixture
+def store():
+    store = RollupStore()
+    start = datetime.datetime(2026, 8, 1, 12, 0)
+    for day in range(70):
+        moment = (start + datetime.timedelta(days=day)).strftime(memory_rollup.DB_TIME_FORMAT)
+        store.conn.execute('INSERT INTO conversation_summaries VALUES (?, ?, ?, ?)',
+                           (f"session {day}", b"", moment, moment))
+    return store
+
+
+def test_capped_builds_complete_the_tree(store):
+    now = datetime.datetime(2026, 10, 18)
+    runs = []
+    while not runs or runs[-1]:
+        runs.append(memory_rollup.MemoryRollup(store).build(now=now, max_periods=20))
+    assert max(runs) == 20
+    assert store.rollup_counts() == {'day': 70, 'week': 11, 'month': 3}
+    assert memory_rollup.MemoryRollup(store).build(now=now, full=True, max_periods=1000) == 0
+
+
+def test_build_stops_when_asked(store):
+    checks = []
+    written = memory_rollup.MemoryRollup(store).build(
+        now=datetime.datetime(2026, 10, 18), should_stop=lambda: checks.append(1) or len(checks) > 3)
+    assert written == 3
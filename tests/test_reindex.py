@@ -0,0 +1,65 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+
+enhance_vectordb = pytest.importorskip("enhance_vectordb")
+import embedding_service  # noqa: E402
+import reindex  # noqa: E402
+import vector_codec  # noqa: E402
+
+NEW_MODEL = "other-model"
+
+
+def fake_encode(texts, use_cache=True, model_name=None):
+    # Models differ in width, as all-MiniLM-L6-v2 (384) and larger encoders do
+    width = 6 if model_name == NEW_MODEL else 4
+    return np.array([[len(text) + i for i in range(width)] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(embedding_service, "encode", fake_encode)
+    db = enhance_vectordb.EnhancedVectorDatabase(str(tmp_path / "chat.db"), summary_processes=False,
+                                                 storage='float32')
+    db.add_messages(["hello there", "how are you"])
+    yield db
+    db.close()
+
+
+def test_write_encoded_before_a_reindex_is_stored_with_the_new_model(db, monkeypatch):
+    executor = ThreadPoolExecutor(1)
+
+    def encode_then_reindex(texts, use_cache=True, model_name=None):
+        vectors = fake_encode(texts, use_cache, model_name)
+        if texts == ["late message"] and model_name != NEW_MODEL:
+            monkeypatch.setattr(embedding_service, "encode", fake_encode)
+            reindex.reindex_database(db, NEW_MODEL, executor)
+        return vectors
+
+    monkeypatch.setattr(embedding_service, "encode", encode_then_reindex)
+    db.add_messages(["late message"])
+    executor.shutdown()
+
+    rows = db.get_connection().execute('SELECT text, embedding, embedding_model FROM messages').fetchall()
+    assert {model for _, _, model in rows} == {NEW_MODEL}
+    assert all(len(vector_codec.decode(blob)) == 6 for _, blob, _ in rows)
+    assert db.semantic_search("late message", 1)[0]["content"] == "late message"
+    assert db.hybrid_search("late message", 1)[0]["content"] == "late message"
+
+
+def test_search_re_encodes_rows_stored_with_a_replaced_model(db):
+    with ThreadPoolExecutor(1) as executor:
+        reindex.reindex_database(db, NEW_MODEL, executor)
+    # A writer running older code inserts a row embedded with the previous model
+    conn = sqlite3.connect(db.db_path)
+    conn.execute('INSERT INTO messages (text, embedding, embedding_model) VALUES (?, ?, ?)',
+                 ("stale row", vector_codec.encode(fake_encode(["stale row"])[0], 'float32'),
+                  embedding_service.MODEL_NAME))
+    conn.commit()
+    conn.close()
+
+    assert db.semantic_search("stale row", 1)[0]["content"] == "stale row"
+    assert db.hybrid_search("stale row", 1)[0]["content"] == "stale row"
+    assert db.get_connection().execute("SELECT embedding_model FROM messages WHERE text = 'stale row'").fetchone() \
+        == (NEW_MODEL,)
@@ -0,0 +1,111 @@
+import argparse
+import logging
+import os
+import struct
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Quantised blobs start with MAGIC and a format byte; int8 blobs then carry a
+# float32 scale. Blobs without the header are plain float32 from before
+# quantisation was added.
+MAGIC = b'EVQ'
+FORMAT_CODES = {'float32': 0, 'float16': 1, 'int8': 2}
+FORMAT_NAMES = {code: name for name, code in FORMAT_CODES.items()}
+DEFAULT_FORMAT = os.getenv('EMBEDDING_STORAGE', 'float16')
+
+
+def check_format(fmt):
+    if fmt not in FORMAT_CODES:
+        raise ValueError(f"Unsupported embedding storage format: {fmt}")
+    return fmt
+
+
+def quantize_rows(matrix, fmt):
+    """Return ``(data, scales)`` for the rows of ``matrix``; ``scales`` is None except for int8."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if fmt == 'float32':
+        return matrix, None
+    if fmt == 'float16':
+        return matrix.astype(np.float16), None
+    check_format(fmt)
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    data = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return data, scales.astype(np.float32)
+
+
+def dequantize_rows(data, scales=None):
+    matrix = data.astype(np.float32)
+    if scales is not None:
+        matrix *= scales[:, None]
+    return matrix
+
+
+def encode(vector, fmt=DEFAULT_FORMAT):
+    """Serialise one vector to a BLOB in ``fmt``."""
+    vector = np.asarray(vector, dtype=np.float32).reshape(1, -1)
+    data, scales = quantize_rows(vector, check_format(fmt))
+    header = MAGIC + bytes([FORMAT_CODES[fmt]])
+    if scales is not None:
+        header += struct.pack('<f', scales[0])
+    return header + data.tobytes()
+
+
+def blob_format(blob):
+    if len(blob) >= 4 and blob[:3] == MAGIC and blob[3] in FORMAT_NAMES:
+        return FORMAT_NAMES[blob[3]]
+    return None  # headerless float32
+
+
+def decode(blob):
+    """Deserialise a BLOB written by ``encode`` (or a headerless float32 one) to float32."""
+    fmt = blob_format(blob)
+    if fmt is None:
+        return np.frombuffer(blob, dtype=np.float32)
+    if fmt == 'float32':
+        return np.frombuffer(blob, dtype=np.float32, offset=4)
+    if fmt == 'float16':
+        return np.frombuffer(blob, dtype=np.float16, offset=4).astype(np.float32)
+    scale = struct.unpack_from('<f', blob, 4)[0]
+    return np.frombuffer(blob, dtype=np.int8, offset=8).astype(np.float32) * scale
+
+
+def decode_many(blobs):
+    return np.stack([decode(blob) for blob in blobs])
+
+
+def migrate(conn, tables, fmt=DEFAULT_FORMAT, batch_size=1000):
+    """Rewrite every ``embedding`` BLOB in ``tables`` that is not already in ``fmt``; returns the count."""
+    check_format(fmt)
+    rewritten = 0
+    for table in tables:
+        last_id = 0
+        while True:
+            rows = conn.execute(f'SELECT id, embedding FROM {table} WHERE id > ? ORDER BY id LIMIT ?',
+                                (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updates = [(encode(decode(blob), fmt), row_id) for row_id, blob in rows if blob_format(blob) != fmt]
+            if updates:
+                conn.executemany(f'UPDATE {table} SET embedding = ? WHERE id = ?', updates)
+                conn.commit()
+                rewritten += len(updates)
+        logger.info(f"Converted {table} embeddings to {fmt}")
+    return rewritten
+
+
+if __name__ == '__main__':
+    from enhance_vectordb import EnhancedVectorDatabase
+
+    parser = argparse.ArgumentParser(description="Rewrite stored embeddings in another storage format")
+    parser.add_argument("--db", default="enhanced_chatbot.db")
+    parser.add_argument("--format", default=DEFAULT_FORMAT, choices=list(FORMAT_CODES))
+    parser.add_argument("--no-vacuum", action="store_true", help="Skip VACUUM after rewriting")
+    args = parser.parse_args()
+
+    db = EnhancedVectorDatabase(args.db, storage=args.format)
+    count = db.migrate_embeddings(vacuum=not args.no_vacuum)
+    print(f"Rewrote {count} embeddings as {args.format}")
+    db.close()
@@ -0,0 +1,158 @@
+import threading
+import numpy as np
+import ann_index
+import vector_codec
+
+# Rows dequantised at a time when scoring float16 or int8 matrices
+SCORE_BLOCK = 65536
+
+
+def normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k(scores, k):
+    """Indices of the ``k`` highest scores, best first, without a full sort."""
+    n = len(scores)
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(scores, n - k)[n - k:]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+class EmbeddingMatrix:
+    """Growable in-memory matrix of unit-normalised embeddings keyed by row id.
+
+    Ids must be appended in increasing order, which matches SQLite
+    AUTOINCREMENT keys, so ``max_id`` tells a store which rows it still needs
+    to load to catch up with the table. Rows are held in the ``storage``
+    format of ``vector_codec`` and dequantised block by block while scoring.
+    With an ``index`` (an ``ann_index.HnswIndex``), unrestricted searches go
+    through the index once the matrix reaches the index's size threshold;
+    the index keeps its rows across ``reset``.
+    """
+
+    def __init__(self, index=None, storage='float32'):
+        self.lock = threading.RLock()
+        self.index = index
+        self.storage = vector_codec.check_format(storage)
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.ids = np.empty(0, dtype=np.int64)
+            self.vectors = None
+            self.scales = None
+            self.size = 0
+            self.max_id = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, ids, vectors):
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        if len(ids) == 0:
+            return
+        vectors = normalize_rows(vectors)
+        with self.lock:
+            keep = ids > self.max_id
+            ids, vectors = ids[keep], vectors[keep]
+            if len(ids) == 0:
+                return
+            data, scales = vector_codec.quantize_rows(vectors, self.storage)
+            needed = self.size + len(ids)
+            if self.vectors is None or needed > len(self.vectors):
+                capacity = max(needed, 2 * (len(self.ids) or 1024))
+                grown = np.zeros((capacity, data.shape[1]), dtype=data.dtype)
+                grown_ids = np.zeros(capacity, dtype=np.int64)
+                grown_scales = np.ones(capacity, dtype=np.float32) if scales is not None else None
+                if self.vectors is not None:
+                    grown[:self.size] = self.vectors[:self.size]
+                    grown_ids[:self.size] = self.ids[:self.size]
+                    if scales is not None:
+                        grown_scales[:self.size] = self.scales[:self.size]
+                self.vectors, self.ids, self.scales = grown, grown_ids, grown_scales
+            self.vectors[self.size:needed] = data
+            self.ids[self.size:needed] = ids
+            if scales is not None:
+                self.scales[self.size:needed] = scales
+            self.size = needed
+            self.max_id = int(ids[-1])
+
+    def rows(self, selection):
+        """Dequantised float32 copy of the rows picked by ``selection`` (a slice or index array)."""
+        scales = self.scales[selection] if self.scales is not None else None
+        return vector_codec.dequantize_rows(self.vectors[selection], scales)
+
+    def _scores(self, query_vector, positions=None):
+        if self.storage == 'float32':
+            vectors = self.vectors[:self.size] if positions is None else self.vectors[positions]
+            return vectors @ query_vector
+        count = self.size if positions is None else len(positions)
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, SCORE_BLOCK):
+            end = min(start + SCORE_BLOCK, count)
+            selection = slice(start, end) if positions is None else positions[start:end]
+            scores[start:end] = self.rows(selection) @ query_vector
+        return scores
+
+    def search(self, query_vector, k=5, ids=None):
+        """Return ``[(id, cosine_similarity), ...]`` best first.
+
+        ``ids`` optionally restricts the search to the given row ids; such
+        searches are always exact.
+        """
+        with self.lock:
+            if self.size == 0:
+                return []
+            if ids is None and self.index is not None and self.index.wanted(self.size):
+                self._sync_index()
+                hits = self.index.search(query_vector, k)
+                if hits is not None:
+                    return hits
+            row_ids = self.ids[:self.size]
+            positions = None
+            if ids is not None:
+                ids = np.asarray(ids, dtype=np.int64)
+                positions = np.searchsorted(row_ids, ids)
+                found = positions < self.size
+                positions, ids = positions[found], ids[found]
+                positions = positions[row_ids[positions] == ids]
+                row_ids = row_ids[positions]
+            scores = self._scores(normalize(query_vector), positions)
+            best = top_k(scores, k)
+            return [(int(row_ids[i]), float(scores[i])) for i in best]
+
+    def _sync_index(self):
+        """Add rows the ANN index has not seen yet, loading the saved index first if there is one."""
+        if self.index.graph is None:
+            self.index.load(self.vectors.shape[1])
+        start = int(np.searchsorted(self.ids[:self.size], self.index.max_label, side='right'))
+        for chunk in range(start, self.size, 10000):
+            end = min(chunk + 10000, self.size)
+            self.index.add(self.ids[chunk:end], self.rows(slice(chunk, end)))
+        if self.index.unsaved >= ann_index.SAVE_EVERY:
+            self.index.save()
+
+    def forget(self, ids):
+        """Tombstone rows that were deleted from the table in the ANN index."""
+        if self.index is not None:
+            self.index.mark_deleted(ids)
+
+    def save_index(self):
+        if self.index is not None and self.index.unsaved:
+            self.index.save()
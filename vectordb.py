@@ -1,7 +1,8 @@
-import sqlite3
-from sentence_transformers import SentenceTransformer
-import numpy as np
-import threading
+import embedding_service
+from db_connections import connections
+import ann_index
+import vector_codec
+from vector_search import EmbeddingMatrix
 import os
 import logging
 
@@ -9,22 +10,19 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class VectorDatabase:
-    _local = threading.local()
-
-    def __init__(self, db_path='chatbot.db'):
+    def __init__(self, db_path='chatbot.db', ann_threshold=ann_index.DEFAULT_THRESHOLD,
+                 storage=vector_codec.DEFAULT_FORMAT):
         self.db_path = os.path.abspath(db_path)
         logger.info(f"Database path: {self.db_path}")
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.storage = vector_codec.check_format(storage)
+        self.matrix = EmbeddingMatrix(ann_index.HnswIndex(self.db_path + ".hnsw", threshold=ann_threshold),
+                                      storage=self.storage)
 
     def get_connection(self):
-        if not hasattr(self._local, 'conn'):
-            logger.info(f"Creating new connection to {self.db_path}")
-            self._local.conn = sqlite3.connect(self.db_path)
-            self.create_table()
-        return self._local.conn
+        return connections.get(self.db_path, self.create_table)
 
-    def create_table(self):
-        cursor = self.get_connection().cursor()
+    def create_table(self, conn):
+        cursor = conn.cursor()
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS messages (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -32,36 +30,73 @@ class VectorDatabase:
                 embedding BLOB NOT NULL
             )
         ''')
-        self.get_connection().commit()
+        conn.commit()
         logger.info("Table 'messages' created or already exists")
 
     def add_message(self, text):
-        embedding = self.model.encode([text])[0]
+        self.add_messages([text])
+        logger.info(f"Added message: {text[:20]}...")
+
+    def add_messages(self, texts):
+        texts = list(texts)
+        if not texts:
+            return
+        embeddings = embedding_service.encode(texts)
         cursor = self.get_connection().cursor()
-        cursor.execute('INSERT INTO messages (text, embedding) VALUES (?, ?)',
-                       (text, embedding.tobytes()))
+        cursor.executemany('INSERT INTO messages (text, embedding) VALUES (?, ?)',
+                           [(text, vector_codec.encode(embedding, self.storage)) for text, embedding in zip(texts, embeddings)])
         self.get_connection().commit()
-        logger.info(f"Added message: {text[:20]}...")
+        if len(self.matrix):
+            self._sync_matrix()
+        logger.info(f"Added {len(texts)} messages")
 
-    def search_similar(self, query, top_k=5):
-        query_embedding = self.model.encode([query])[0]
+    def _sync_matrix(self):
+        """Load any messages newer than the in-memory matrix."""
+        with self.matrix.lock:
+            cursor = self.get_connection().cursor()
+            cursor.execute('SELECT id, embedding FROM messages WHERE id > ? ORDER BY id', (self.matrix.max_id,))
+            while True:
+                rows = cursor.fetchmany(10000)
+                if not rows:
+                    break
+                self.matrix.append(
+                    [row[0] for row in rows],
+                    vector_codec.decode_many([row[1] for row in rows]))
+
+    def _fetch_texts(self, ids):
+        if not ids:
+            return {}
+        placeholders = ','.join('?' * len(ids))
         cursor = self.get_connection().cursor()
-        cursor.execute('SELECT id, text, embedding FROM messages')
-        results = []
-        for row in cursor.fetchall():
-            db_embedding = np.frombuffer(row[2], dtype=np.float32)
-            similarity = np.dot(query_embedding, db_embedding) / (
-                        np.linalg.norm(query_embedding) * np.linalg.norm(db_embedding))
-            results.append((row[0], row[1], similarity))
-        results.sort(key=lambda x: x[2], reverse=True)
+        cursor.execute(f'SELECT id, text FROM messages WHERE id IN ({placeholders})', ids)
+        return dict(cursor.fetchall())
+
+    def search_similar(self, query, top_k=5):
+        query_embedding = embedding_service.encode_one(query)
+        self._sync_matrix()
+        hits = self.matrix.search(query_embedding, top_k)
+        texts = self._fetch_texts([message_id for message_id, _ in hits])
+        if len(texts) < len(hits):
+            # Rows were deleted behind our back; rebuild and try again
+            self.matrix.forget([message_id for message_id, _ in hits if message_id not in texts])
+            self.matrix.reset()
+            self._sync_matrix()
+            hits = self.matrix.search(query_embedding, top_k)
+            texts = self._fetch_texts([message_id for message_id, _ in hits])
+        results = [(message_id, texts[message_id], similarity) for message_id, similarity in hits
+                   if message_id in texts]
         logger.info(f"Found {len(results)} similar messages")
-        return results[:top_k]
+        return results
+
+    def migrate_embeddings(self):
+        """Rewrite stored embeddings in this database's storage format; returns the number rewritten."""
+        count = vector_codec.migrate(self.get_connection(), ['messages'], self.storage)
+        self.matrix.reset()
+        return count
 
     def close(self):
-        if hasattr(self._local, 'conn'):
-            self._local.conn.close()
-            del self._local.conn
-            logger.info("Closed database connection")
+        self.matrix.save_index()
+        connections.close(self.db_path)
 
     def check_db_file(self):
         if os.path.exists(self.db_path):
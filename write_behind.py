@@ -0,0 +1,143 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """Background worker that persists messages, summaries and entity vectors.
+
+    Producers enqueue writes and return immediately. The worker collects them
+    for up to ``flush_interval`` seconds (or ``max_batch`` items) and then
+    applies them in order, merging consecutive message writes to the same
+    store into one ``add_messages`` call and consecutive entity
+    vectorisations into one batch, keeping only the latest data per entity
+    and the union of the fields changed in between.
+    """
+
+    def __init__(self, flush_interval=0.5, max_batch=64):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="WriteBehindQueue", daemon=True)
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def add_messages(self, store, texts):
+        self.queue.put(("messages", store, list(texts)))
+
+    def vectorize_entity(self, entity_db, entity_name, entity_data, fields=None):
+        """Queue re-embedding of ``fields`` of an entity (None for all of them)."""
+        self.queue.put(("entity", entity_db, entity_name, entity_data, None if fields is None else set(fields)))
+
+    def call(self, fn, *args, **kwargs):
+        self.queue.put(("call", fn, args, kwargs))
+
+    def flush(self, timeout=None):
+        """Block until everything enqueued so far has been written."""
+        if not self.running:
+            return True
+        done = threading.Event()
+        self.queue.put(("flush", done))
+        return done.wait(timeout)
+
+    def stop(self, timeout=None):
+        if not self.running:
+            return
+        self.running = False
+        self.queue.put(("stop",))
+        self.thread.join(timeout)
+
+    def _run(self):
+        pending = []
+        deadline = None
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if pending else None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is None:
+                self._write(pending)
+                pending = []
+                continue
+            kind = item[0]
+            if kind == "flush":
+                self._write(pending)
+                pending = []
+                item[1].set()
+            elif kind == "stop":
+                self._write(pending)
+                return
+            else:
+                pending.append(item)
+                if len(pending) == 1:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(pending) >= self.max_batch:
+                    self._write(pending)
+                    pending = []
+
+    def _write(self, pending):
+        i = 0
+        while i < len(pending):
+            kind = pending[i][0]
+            if kind == "messages":
+                store = pending[i][1]
+                texts = []
+                while i < len(pending) and pending[i][0] == "messages" and pending[i][1] is store:
+                    texts.extend(pending[i][2])
+                    i += 1
+                self._apply(store.add_messages, texts)
+            elif kind == "entity":
+                batches = OrderedDict()
+                while i < len(pending) and pending[i][0] == "entity":
+                    _, entity_db, entity_name, entity_data, fields = pending[i]
+                    db, entities, changed = batches.setdefault(entity_db.db_folder, (entity_db, {}, {}))
+                    if entity_name in entities:
+                        previous = changed[entity_name]
+                        fields = None if previous is None or fields is None else previous | fields
+                    entities.pop(entity_name, None)
+                    entities[entity_name] = entity_data
+                    changed[entity_name] = fields
+                    i += 1
+                for db, entities, changed in batches.values():
+                    self._apply(db.vectorize_entities, entities, changed)
+            else:
+                _, fn, args, kwargs = pending[i]
+                self._apply(fn, *args, **kwargs)
+                i += 1
+
+    @staticmethod
+    def _apply(fn, *args, **kwargs):
+        try:
+            fn(*args, **kwargs)
+        except Exception:
+            logger.exception(f"Write-behind job {getattr(fn, '__qualname__', fn)} failed")
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> WriteBehindQueue:
+    """Return the process-wide write-behind queue, starting it if needed."""
+    global _queue
+    with _queue_lock:
+        if _queue is None or not _queue.running:
+            _queue = WriteBehindQueue()
+            _queue.start()
+        return _queue
+
+
+@atexit.register
+def _stop_queue():
+    if _queue is not None:
+        _queue.stop()